@@ -5,16 +5,53 @@ Runs mtr against a target and exports metrics in Prometheus format
 Enhanced with multi-probe configuration support
 """
 
+import asyncio
+import statistics
 import subprocess
-import json
-import time
+import warnings
 import argparse
+import logging
 import sys
+import threading
 import yaml
 import os
-from datetime import datetime
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Optional, Tuple
+
+# Pick the fastest available JSON parser once; the hot path calls _loads directly
+try:
+    from orjson import loads as _loads
+except ImportError:
+    try:
+        from ujson import loads as _loads
+    except ImportError:
+        from json import loads as _loads
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = logging.getLogger('mtr_exporter')
+
+# Below this many cycles per hop the pure-Python statistics are faster
+_NUMPY_MIN_SAMPLES = 100
+
+# Metric families in output order: (name, help text); all are gauges
+_FAMILIES = [
+    ('mtr_end_to_end_avg_rtt_ms', 'End-to-end average round-trip time in milliseconds'),
+    ('mtr_end_to_end_loss_percent', 'End-to-end packet loss percentage'),
+    ('mtr_end_to_end_jitter_ms', 'End-to-end jitter (standard deviation) in milliseconds'),
+    ('mtr_hop_count', 'Number of network hops to target'),
+    ('mtr_avg_rtt_ms', 'Average round-trip time per hop in milliseconds'),
+    ('mtr_loss_percent', 'Packet loss percentage per hop'),
+]
+
+# HELP/TYPE lines are constant, so build and encode them once at import time
+_FAMILY_HEADERS = [f"# HELP {name} {help_text}\n# TYPE {name} gauge\n".encode('utf-8')
+                   for name, help_text in _FAMILIES]
 
 
 def setup_logging(log_level, log_file=None):
@@ -32,103 +69,261 @@ def setup_logging(log_level, log_file=None):
     )
 
 
-def run_mtr(target, port=None, count=10):
-    """Run MTR and return parsed results"""
-    cmd = ['mtr', '--report', '--report-cycles', str(count), '--json']
+def build_mtr_command(target, port=None, count=10, report_format='json'):
+    """Build the mtr argument list for a target"""
+    if report_format == 'raw':
+        # Line-oriented raw output; statistics are computed in parse_mtr_raw
+        cmd = ['mtr', '--raw', '--report-cycles', str(count)]
+    else:
+        cmd = ['mtr', '--report', '--report-cycles', str(count), '--json']
     
     if port:
         cmd.extend(['--port', str(port)])
     
     cmd.append(target)
     
-    logging.info(f"Running MTR command: {' '.join(cmd)}")
+    return cmd
+
+
+def parse_mtr_raw(stdout, target, count):
+    """Build a report equivalent to mtr --json from mtr --raw output bytes"""
+    hosts = {}
+    samples = {}
+    sent = {}
+    last_pos = -1
+    last_known = -1
+    
+    # Raw lines look like "h 0 10.0.0.1", "d 0 gw.lan", "p 0 1234 7" (RTT in
+    # microseconds) and, on newer mtr, "x 0 7" for every probe transmitted
+    for line in stdout.splitlines():
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        try:
+            pos = int(fields[1])
+        except ValueError:
+            continue
+        kind = fields[0]
+        if kind == b'p':
+            samples.setdefault(pos, []).append(int(fields[2]) / 1000.0)
+        elif kind == b'x':
+            sent[pos] = sent.get(pos, 0) + 1
+        elif kind == b'h' or kind == b'd':
+            # DNS names ("d") take precedence over addresses, as in the report
+            if kind == b'd' or pos not in hosts:
+                hosts[pos] = fields[2].decode('utf-8', 'replace')
+        else:
+            continue
+        last_pos = max(last_pos, pos)
+        if kind != b'x':
+            last_known = max(last_known, pos)
+    
+    # Keep the hops mtr's own report shows (net_max() in mtr): up to the destination,
+    # or, when probes went past the last hop that answered, that hop plus one ???
+    if last_known < 0:
+        hop_total = 0
+    elif last_pos > last_known:
+        hop_total = last_known + 2
+    else:
+        hop_total = last_known + 1
+    positions = range(hop_total)
+    rtt_lists = [samples.get(pos, []) for pos in positions]
+    
+    # With many samples per hop, compute every hop's statistics at once
+    if np is not None and count >= _NUMPY_MIN_SAMPLES and rtt_lists:
+        width = max(len(rtts) for rtts in rtt_lists) or 1
+        arr = np.full((len(rtt_lists), width), np.nan)
+        for row, rtts in enumerate(rtt_lists):
+            arr[row, :len(rtts)] = rtts
+        replied = np.count_nonzero(~np.isnan(arr), axis=1)
+        with np.errstate(invalid='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            stats = np.nan_to_num(np.stack([
+                np.nanmean(arr, axis=1),
+                np.nanmin(arr, axis=1),
+                np.nanmax(arr, axis=1),
+                np.nanstd(arr, axis=1, ddof=1),
+            ]))
+        stats[3][replied < 2] = 0.0
+        avgs, bests, worsts, stdevs = np.round(stats, 2).tolist()
+    else:
+        avgs = [statistics.fmean(rtts) if rtts else 0.0 for rtts in rtt_lists]
+        bests = [min(rtts) if rtts else 0.0 for rtts in rtt_lists]
+        worsts = [max(rtts) if rtts else 0.0 for rtts in rtt_lists]
+        # Sample standard deviation, as mtr reports it
+        stdevs = [statistics.stdev(rtts) if len(rtts) > 1 else 0.0 for rtts in rtt_lists]
+    
+    hubs = []
+    for pos in positions:
+        rtts = rtt_lists[pos]
+        snt = max(sent.get(pos, count), len(rtts)) or 1
+        hubs.append({
+            'count': pos + 1,
+            'host': hosts.get(pos, '???'),
+            'Loss%': round(100.0 * (snt - len(rtts)) / snt, 1),
+            'Snt': snt,
+            'Last': round(rtts[-1], 2) if rtts else 0.0,
+            'Avg': round(avgs[pos], 2),
+            'Best': round(bests[pos], 2),
+            'Wrst': round(worsts[pos], 2),
+            'StDev': round(stdevs[pos], 2),
+        })
+    
+    return {'report': {'mtr': {'dst': target}, 'hubs': hubs}}
+
+
+def parse_mtr_output(returncode, stdout, stderr, target, count, report_format='json'):
+    """Parse mtr output bytes into a report dict"""
+    if returncode != 0:
+        log.error(f"MTR failed: {stderr.decode('utf-8', 'replace')}")
+        return None
+    
+    if report_format == 'raw':
+        return parse_mtr_raw(stdout, target, count)
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-        if result.returncode != 0:
-            logging.error(f"MTR failed: {result.stderr}")
-            return None
-        
-        return json.loads(result.stdout)
+        return _loads(stdout)
+    except ValueError as e:
+        log.error(f"Failed to parse MTR JSON output: {e}")
+        return None
+
+
+def run_mtr(target, port=None, count=10, report_format='json'):
+    """Run MTR and return parsed results"""
+    cmd = build_mtr_command(target, port, count, report_format)
+    
+    if log.isEnabledFor(logging.INFO):
+        log.info(f"Running MTR command: {' '.join(cmd)}")
+    
+    try:
+        # Keep stdout as bytes; both parsers work on it without a decode pass
+        result = subprocess.run(cmd, capture_output=True, timeout=60)
+        return parse_mtr_output(result.returncode, result.stdout, result.stderr,
+                                target, count, report_format)
     except subprocess.TimeoutExpired:
-        logging.error("MTR command timed out")
+        log.error("MTR command timed out")
         return None
-    except json.JSONDecodeError as e:
-        logging.error(f"Failed to parse MTR JSON output: {e}")
+    except Exception as e:
+        log.error(f"Error running MTR: {e}")
         return None
+
+
+async def run_mtr_async(target, port=None, count=10, report_format='json', cmd=None):
+    """Run MTR on the event loop and return parsed results"""
+    if cmd is None:
+        cmd = build_mtr_command(target, port, count, report_format)
+    
+    if log.isEnabledFor(logging.INFO):
+        log.info(f"Running MTR command: {' '.join(cmd)}")
+    
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), 60)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            log.error("MTR command timed out")
+            return None
+        return parse_mtr_output(proc.returncode, stdout, stderr, target, count, report_format)
     except Exception as e:
-        logging.error(f"Error running MTR: {e}")
+        log.error(f"Error running MTR: {e}")
         return None
 
 
-def format_prometheus_metrics(mtr_data, probe_name, labels_dict=None):
-    """Convert MTR data to Prometheus format"""
+def _esc(value):
+    """Escape a label value per the Prometheus text format"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def build_base_labels(labels_dict, target, probe_name):
+    """Build the escaped, encoded label string shared by a probe's metrics"""
+    label_parts = []
+    if labels_dict:
+        for key, value in labels_dict.items():
+            label_parts.append(f'{key}="{_esc(str(value))}"')
+    
+    label_parts.append(f'target="{_esc(target)}"')
+    label_parts.append(f'probe="{_esc(probe_name)}"')
+    
+    return ','.join(label_parts).encode('utf-8')
+
+
+def format_metric_families(mtr_data, probe_name, labels_dict=None, base_labels=None):
+    """Convert MTR data to one block of samples per metric family (UTF-8 encoded bytes,
+    in _FAMILIES order); returns None when there is nothing to report"""
     if not mtr_data or 'report' not in mtr_data:
-        return ""
+        return None
     
     report = mtr_data['report']
     hubs = report.get('hubs', [])
     
     if not hubs:
-        logging.warning("No hubs found in MTR report")
-        return ""
-    
-    timestamp = int(time.time() * 1000)
-    metrics = []
-    
-    # Build labels from dictionary
-    label_parts = []
-    if labels_dict:
-        for key, value in labels_dict.items():
-            label_parts.append(f'{key}="{value}"')
-    
-    target = report.get('mtr', {}).get('dst', 'unknown')
-    label_parts.append(f'target="{target}"')
-    label_parts.append(f'probe="{probe_name}"')
+        log.warning("No hubs found in MTR report")
+        return None
     
-    base_labels = ','.join(label_parts)
+    # Encode the invariant pieces once; the buffers are then filled with bytes.
+    # Samples carry no timestamp: Prometheus stamps them at scrape time and the
+    # textfile collector rejects explicit timestamps
+    if base_labels is None:
+        target = report.get('mtr', {}).get('dst', 'unknown')
+        base_labels = build_base_labels(labels_dict, target, probe_name)
     
     # End-to-end metrics (last hop)
     last_hop = hubs[-1]
     
-    metrics.append(f"# HELP mtr_end_to_end_avg_rtt_ms End-to-end average round-trip time in milliseconds")
-    metrics.append(f"# TYPE mtr_end_to_end_avg_rtt_ms gauge")
-    metrics.append(f"mtr_end_to_end_avg_rtt_ms{{{base_labels}}} {last_hop.get('Avg', 0)} {timestamp}")
-    
-    metrics.append(f"# HELP mtr_end_to_end_loss_percent End-to-end packet loss percentage")
-    metrics.append(f"# TYPE mtr_end_to_end_loss_percent gauge")
-    metrics.append(f"mtr_end_to_end_loss_percent{{{base_labels}}} {last_hop.get('Loss%', 0)} {timestamp}")
-    
     # Calculate jitter as standard deviation
     jitter = last_hop.get('StDev', 0)
-    metrics.append(f"# HELP mtr_end_to_end_jitter_ms End-to-end jitter (standard deviation) in milliseconds")
-    metrics.append(f"# TYPE mtr_end_to_end_jitter_ms gauge")
-    metrics.append(f"mtr_end_to_end_jitter_ms{{{base_labels}}} {jitter} {timestamp}")
-    
-    # Hop count
     hop_count = len(hubs)
-    metrics.append(f"# HELP mtr_hop_count Number of network hops to target")
-    metrics.append(f"# TYPE mtr_hop_count gauge")
-    metrics.append(f"mtr_hop_count{{{base_labels}}} {hop_count} {timestamp}")
-    
-    # Per-hop metrics
-    metrics.append(f"# HELP mtr_avg_rtt_ms Average round-trip time per hop in milliseconds")
-    metrics.append(f"# TYPE mtr_avg_rtt_ms gauge")
-    
-    metrics.append(f"# HELP mtr_loss_percent Packet loss percentage per hop")
-    metrics.append(f"# TYPE mtr_loss_percent gauge")
     
+    families = [
+        b''.join((name, b'{', base_labels, b'} ', repr(value).encode('ascii'), b'\n'))
+        for name, value in ((b'mtr_end_to_end_avg_rtt_ms', last_hop.get('Avg', 0)),
+                            (b'mtr_end_to_end_loss_percent', last_hop.get('Loss%', 0)),
+                            (b'mtr_end_to_end_jitter_ms', jitter),
+                            (b'mtr_hop_count', hop_count))
+    ]
+    
+    # Per-hop metrics; repr() formats the numbers without the format-spec path
+    avg_buf = bytearray()
+    loss_buf = bytearray()
+    hop_prefix = b'{' + base_labels + b',hop="'
     for i, hub in enumerate(hubs, 1):
         host = hub.get('host', 'unknown')
         avg_rtt = hub.get('Avg', 0)
         loss_pct = hub.get('Loss%', 0)
         
-        hop_labels = f"{base_labels},hop=\"{i}\",host=\"{host}\""
+        # One label block per hop, shared by both of its metric lines
+        hop_labels = b''.join((hop_prefix, str(i).encode('ascii'),
+                               b'",host="', _esc(host).encode('utf-8'), b'"} '))
         
-        metrics.append(f"mtr_avg_rtt_ms{{{hop_labels}}} {avg_rtt} {timestamp}")
-        metrics.append(f"mtr_loss_percent{{{hop_labels}}} {loss_pct} {timestamp}")
-    
-    return "\n".join(metrics) + "\n"
+        avg_buf += b'mtr_avg_rtt_ms'
+        avg_buf += hop_labels
+        avg_buf += repr(avg_rtt).encode('ascii')
+        avg_buf += b'\n'
+        loss_buf += b'mtr_loss_percent'
+        loss_buf += hop_labels
+        loss_buf += repr(loss_pct).encode('ascii')
+        loss_buf += b'\n'
+    
+    families.append(bytes(avg_buf))
+    families.append(bytes(loss_buf))
+    return families
+
+
+def render_families(probe_families):
+    """Join probes' family blocks family-major: each family's HELP/TYPE followed by
+    every probe's samples of that family, as the exposition format expects"""
+    return b''.join(header + b''.join(families[i] for families in probe_families)
+                    for i, header in enumerate(_FAMILY_HEADERS))
+
+
+def format_prometheus_metrics(mtr_data, probe_name, labels_dict=None):
+    """Convert MTR data to Prometheus format (UTF-8 encoded bytes)"""
+    families = format_metric_families(mtr_data, probe_name, labels_dict)
+    return render_families([families]) if families else b""
 
 
 def load_config(config_file):
@@ -137,33 +332,152 @@ def load_config(config_file):
         with open(config_file, 'r') as f:
             return yaml.safe_load(f)
     except FileNotFoundError:
-        logging.error(f"Configuration file not found: {config_file}")
+        log.error(f"Configuration file not found: {config_file}")
         return None
     except yaml.YAMLError as e:
-        logging.error(f"Error parsing configuration file: {e}")
+        log.error(f"Error parsing configuration file: {e}")
         return None
 
 
-def run_single_probe(probe_name, target, port, labels, count, output_dir):
+def _atomic_write(path, chunks):
+    """Write encoded metric chunks to path via a fsynced temp file and os.replace"""
+    path = Path(path)
+    temp_path = path.with_name(path.name + '.tmp')
+    try:
+        # Chunks are already encoded, so write them straight through in binary mode
+        with temp_path.open('wb') as f:
+            f.writelines(c if c.endswith(b'\n') else c + b'\n' for c in chunks)
+            f.flush()
+            os.fsync(f.fileno())
+        
+        # Atomic on POSIX and Windows, unlike os.rename over an existing file
+        temp_path.replace(path)
+    except Exception:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+
+@dataclass(frozen=True)
+class Probe:
+    """A configured probe with its mtr command and labels precomputed"""
+    name: str
+    target: str
+    port: Optional[int]
+    count: int
+    report_format: str
+    labels_str: bytes
+    cmd: Tuple[str, ...]
+
+
+def build_probes(probe_configs, mtr_cycles, report_format='json'):
+    """Validate probe configuration once and return Probe objects"""
+    probes = []
+    for probe in probe_configs:
+        name = probe.get('name', 'unknown')
+        target = probe.get('target')
+        if not target:
+            log.warning(f"Skipping probe '{name}': no target specified")
+            continue
+        port = probe.get('port')
+        probes.append(Probe(
+            name=name,
+            target=target,
+            port=port,
+            count=mtr_cycles,
+            report_format=report_format,
+            labels_str=build_base_labels(probe.get('labels', {}), target, name),
+            cmd=tuple(build_mtr_command(target, port, mtr_cycles, report_format)),
+        ))
+    return probes
+
+
+async def run_single_probe(probe):
     """Run MTR for a single probe and return metrics"""
-    logging.info(f"Running probe '{probe_name}' for {target}:{port}")
+    log.info(f"Running probe '{probe.name}' for {probe.target}:{probe.port}")
     
     # Run MTR
-    mtr_data = run_mtr(target, port, count)
+    mtr_data = await run_mtr_async(probe.target, probe.port, probe.count,
+                                   probe.report_format, probe.cmd)
     if not mtr_data:
-        logging.error(f"Failed to get MTR data for probe '{probe_name}'")
+        log.error(f"Failed to get MTR data for probe '{probe.name}'")
         return None
     
-    # Format as Prometheus metrics
-    prometheus_metrics = format_prometheus_metrics(mtr_data, probe_name, labels)
-    if not prometheus_metrics:
-        logging.error(f"Failed to format Prometheus metrics for probe '{probe_name}'")
+    # Format as per-family sample blocks; the caller groups every probe's
+    # samples under one HELP/TYPE header per family
+    families = format_metric_families(mtr_data, probe.name, base_labels=probe.labels_str)
+    if not families:
+        log.error(f"Failed to format Prometheus metrics for probe '{probe.name}'")
         return None
     
-    return prometheus_metrics
+    return families
+
+
+def collect_probe_metrics(probes):
+    """Run all probes concurrently and return their metric family blocks in order"""
+    async def run_all_probes():
+        return await asyncio.gather(*[run_single_probe(probe) for probe in probes],
+                                    return_exceptions=True)
+    
+    all_metrics = []
+    for probe, result in zip(probes, asyncio.run(run_all_probes())):
+        if isinstance(result, BaseException):
+            log.error(f"Probe '{probe.name}' failed: {result}")
+        elif result:
+            all_metrics.append(result)
+    
+    return all_metrics
 
 
-def run_config_mode(config_file):
+def serve_metrics(listen_port, probes, probe_interval):
+    """Probe in a background loop and serve the latest results on /metrics"""
+    # No body until the first probe round has published results
+    latest = {'body': None}
+    stop = threading.Event()
+    
+    def probe_loop():
+        while not stop.is_set():
+            all_metrics = collect_probe_metrics(probes)
+            if all_metrics:
+                latest['body'] = render_families(all_metrics)
+            else:
+                log.error("No successful probe results")
+            stop.wait(probe_interval)
+    
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = latest['body']
+            if body is None:
+                # An empty 200 would be a successful scrape with every series absent
+                self.send_error(503, 'No probe results yet')
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            log.debug(format % args)
+    
+    worker = threading.Thread(target=probe_loop, name='mtr-probe-loop', daemon=True)
+    worker.start()
+    
+    server = ThreadingHTTPServer(('', listen_port), MetricsHandler)
+    log.info(f"Serving metrics on :{listen_port}/metrics every {probe_interval}s")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+    return True
+
+
+def run_config_mode(config_file, listen_port=None, probe_interval=60):
     """Run multiple probes based on configuration file"""
     config = load_config(config_file)
     if not config:
@@ -175,84 +489,78 @@ def run_config_mode(config_file):
     log_level = global_config.get('log_level', 'INFO')
     log_file = global_config.get('log_file', './mtr_exporter.log')
     mtr_cycles = global_config.get('mtr_cycles', 10)
+    report_format = global_config.get('report_format', 'json')
     
     # Setup logging
     setup_logging(log_level, log_file)
     
-    # Create output directory
-    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    # Create output directory and resolve the output path once
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    output_file = output_path / "mtr_all_probes.prom"
     
     # Get probes configuration
     probes = config.get('probes', [])
     if not probes:
-        logging.error("No probes defined in configuration file")
+        log.error("No probes defined in configuration file")
         return False
     
-    all_metrics = []
+    # Resolve each probe's command and labels once; probes spend nearly all
+    # their time waiting on mtr, so every subprocess is supervised from one
+    # event loop and gather keeps configuration order
+    runnable = build_probes(probes, mtr_cycles, report_format)
     
-    for probe in probes:
-        probe_name = probe.get('name', 'unknown')
-        target = probe.get('target')
-        port = probe.get('port')
-        labels = probe.get('labels', {})
-        
-        if not target:
-            logging.warning(f"Skipping probe '{probe_name}': no target specified")
-            continue
-        
-        metrics = run_single_probe(probe_name, target, port, labels, mtr_cycles, output_dir)
-        if metrics:
-            all_metrics.append(metrics)
+    if listen_port is not None:
+        return serve_metrics(listen_port, runnable, probe_interval)
+    
+    all_metrics = collect_probe_metrics(runnable)
     
     if not all_metrics:
-        logging.error("No successful probe results")
+        log.error("No successful probe results")
         return False
     
     # Write combined metrics to file
-    output_file = os.path.join(output_dir, "mtr_all_probes.prom")
-    temp_file = output_file + ".tmp"
-    
     try:
-        with open(temp_file, 'w') as f:
-            f.write('\n'.join(all_metrics))
-        
-        # Atomic move
-        os.rename(temp_file, output_file)
-        logging.info(f"Successfully wrote combined metrics to {output_file}")
+        _atomic_write(output_file, [render_families(all_metrics)])
+        log.info(f"Successfully wrote combined metrics to {output_file}")
         return True
     except Exception as e:
-        logging.error(f"Failed to write output file: {e}")
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
+        log.error(f"Failed to write output file: {e}")
         return False
 
 
 def main():
-    # Check if --config is in args, if so use config mode
-    if '--config' in sys.argv:
-        parser = argparse.ArgumentParser(description='MTR to Prometheus Exporter - Config Mode')
-        parser.add_argument('--config', required=True, help='Configuration file path')
-        args = parser.parse_args()
-        
-        if not run_config_mode(args.config):
-            sys.exit(1)
-        return
-    
-    # Otherwise use single probe mode (backwards compatible)
+    # One parser covers both modes: --config selects config mode, otherwise
+    # the single probe arguments are used (backwards compatible)
     parser = argparse.ArgumentParser(description='MTR to Prometheus Exporter')
-    parser.add_argument('target', help='Target hostname or IP address')
+    parser.add_argument('--config', help='Configuration file path (config mode)')
+    parser.add_argument('--listen-port', type=int, help='Config mode: keep running and serve /metrics on this port')
+    parser.add_argument('--probe-interval', type=int, default=60, help='Seconds between probe rounds with --listen-port')
+    parser.add_argument('target', nargs='?', help='Target hostname or IP address')
     parser.add_argument('--port', type=int, help='Target port number')
-    parser.add_argument('--output', required=True, help='Output file path')
+    parser.add_argument('--output', help='Output file path')
     parser.add_argument('--custom-label', default='', help='Custom Prometheus labels')
     parser.add_argument('--log-level', default='INFO', help='Log level')
     parser.add_argument('--log-file', help='Log file path')
     parser.add_argument('--count', type=int, default=10, help='Number of MTR cycles')
+    parser.add_argument('--report-format', choices=['json', 'raw'], default='json',
+                        help='mtr output to parse: json (default) or raw')
     
     args = parser.parse_args()
     
+    if args.config is not None:
+        if not run_config_mode(args.config, args.listen_port, args.probe_interval):
+            sys.exit(1)
+        return
+    
+    if not args.target:
+        parser.error('the following arguments are required: target')
+    if not args.output:
+        parser.error('the following arguments are required: --output')
+    
     setup_logging(args.log_level, args.log_file)
     
-    logging.info(f"Starting MTR export for {args.target}")
+    log.info(f"Starting MTR export for {args.target}")
     
     # Parse custom labels for backwards compatibility
     labels_dict = {}
@@ -263,27 +571,26 @@ def main():
                 labels_dict[key.strip()] = value.strip().strip('"')
     
     # Run MTR
-    mtr_data = run_mtr(args.target, args.port, args.count)
+    mtr_data = run_mtr(args.target, args.port, args.count, args.report_format)
     if not mtr_data:
-        logging.error("Failed to get MTR data")
+        log.error("Failed to get MTR data")
         sys.exit(1)
     
     # Format as Prometheus metrics
     prometheus_metrics = format_prometheus_metrics(mtr_data, 'default', labels_dict)
     if not prometheus_metrics:
-        logging.error("Failed to format Prometheus metrics")
+        log.error("Failed to format Prometheus metrics")
         sys.exit(1)
     
     # Write to output file
     try:
-        with open(args.output, 'w') as f:
-            f.write(prometheus_metrics)
-        logging.info(f"Successfully wrote metrics to {args.output}")
+        _atomic_write(args.output, [prometheus_metrics])
+        log.info(f"Successfully wrote metrics to {args.output}")
     except Exception as e:
-        logging.error(f"Failed to write output file: {e}")
+        log.error(f"Failed to write output file: {e}")
         sys.exit(1)
     
-    logging.info("MTR export completed successfully")
+    log.info("MTR export completed successfully")
 
 
 if __name__ == '__main__':
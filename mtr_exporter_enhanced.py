@@ -5,16 +5,83 @@ Runs mtr against a target and exports metrics in Prometheus format
 Enhanced with multi-probe configuration support
 """
 
+import asyncio
+import csv
+import functools
+import re
 import subprocess
 import json
+import logging
 import time
 import argparse
 import sys
 import yaml
 import os
-from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Tuple
+
+# libyaml's C loader when available, pure-Python SafeLoader otherwise
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Hop line of `mtr --report`, e.g.
+#   "  1.|-- _gateway     0.0%    10    1.6   1.6   1.6   1.8   0.1"
+HOP_RE = re.compile(
+    rb'^\s*(\d+)\.\s*[|`]--\s+(\S+)\s+([\d.]+)%\s+(\d+)'
+    rb'\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)(?:\s+([\d.]+))?'
+)
+
+logger = logging.getLogger(__name__)
+
+# Per-hop metric families: (name, help text, type, key in the parsed hop dict)
+HOP_METRIC_FAMILIES = [
+    ('mtr_loss_percent', 'Packet loss percentage per hop', 'gauge', 'loss_percent'),
+    ('mtr_packets_sent', 'Total packets sent per hop', 'counter', 'sent'),
+    ('mtr_last_rtt_ms', 'Last round trip time in milliseconds', 'gauge', 'last_ms'),
+    ('mtr_avg_rtt_ms', 'Average round trip time in milliseconds', 'gauge', 'avg_ms'),
+    ('mtr_best_rtt_ms', 'Best round trip time in milliseconds', 'gauge', 'best_ms'),
+    ('mtr_worst_rtt_ms', 'Worst round trip time in milliseconds', 'gauge', 'worst_ms'),
+    ('mtr_jitter_ms', 'Jitter (standard deviation) in milliseconds', 'gauge', 'stddev_ms'),
+]
+
+# Upper bound on mtr processes running at once in config mode
+MAX_CONCURRENT_PROBES = 16
+
+
+# Report flag for each mtr output format, in order of preference
+MTR_FORMAT_FLAGS = {'json': '-j', 'csv': '--csv', 'report': '--report'}
+
+# Column positions of `mtr --csv` output, used when the header row is missing
+CSV_DEFAULT_COLUMNS = {'Hop': 4, 'Ip': 5, 'Loss%': 6, 'Snt': 7, 'Last': 9, 'Avg': 10,
+                       'Best': 11, 'Wrst': 12, 'StDev': 13}
+
+
+@functools.lru_cache(maxsize=1)
+def mtr_output_format() -> str:
+    """Check once per process which machine-readable output the installed mtr supports"""
+    try:
+        result = subprocess.run(['mtr', '--help'], capture_output=True, timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return 'report'
+    help_text = result.stdout + result.stderr
+    if b'--json' in help_text:
+        return 'json'
+    if b'--csv' in help_text:
+        return 'csv'
+    return 'report'
+
+
+def _esc(value: Any) -> str:
+    """Escape a Prometheus label value"""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
 
 
 class MTRPrometheusExporter:
@@ -25,203 +92,225 @@ class MTRPrometheusExporter:
         self.count = count
         self.interval = interval
         self.probe_name = probe_name
-        self.custom_labels = custom_labels or {}
-        self.timestamp = int(time.time() * 1000)  # milliseconds
-        
-    def run_mtr(self) -> Dict[str, Any]:
-        """Run mtr command and return parsed output"""
-        # Try JSON format first (note: -j conflicts with --report)
-        cmd_json = [
-            'mtr',
-            '-j',
-            '--report-cycles', str(self.count),
-            '--interval', str(self.interval),
-            '--port', str(self.port),
-            self.target
-        ]
-        
-        # Fallback to text format
-        cmd_text = [
+        # Label values are escaped once here, so emission sites only interpolate them
+        self.custom_labels = {key: _esc(value) for key, value in (custom_labels or {}).items()}
+        self.timestamp = time.time_ns() // 1_000_000  # milliseconds
+        
+        # Base label string shared by every series; per-hop labels are appended to it
+        base = {**self.custom_labels, 'target': _esc(target), 'probe': _esc(probe_name)}
+        self._base_labels_str = ','.join(f'{key}="{value}"' for key, value in sorted(base.items()))
+        
+    def build_mtr_command(self, output_format: str) -> List[str]:
+        """Build the mtr command line for JSON, CSV or text report output"""
+        # -j and --csv conflict with --report, so the modes are mutually exclusive
+        return [
             'mtr',
-            '--report',
+            MTR_FORMAT_FLAGS[output_format],
             '--report-cycles', str(self.count),
             '--interval', str(self.interval),
             '--port', str(self.port),
             self.target
         ]
+
+    def parse_mtr_output(self, stdout: bytes, output_format: str) -> Dict[str, Any]:
+        """Parse raw mtr stdout; raises ValueError on malformed output"""
+        if output_format == 'json':
+            return _loads(stdout)
+        if output_format == 'csv':
+            return self.parse_mtr_csv_output(stdout)
+        return self.parse_mtr_text_output(stdout)
+
+    def run_mtr(self) -> Dict[str, Any]:
+        """Run mtr command and return parsed output"""
+        output_format = mtr_output_format()
+        cmd = self.build_mtr_command(output_format)
         
         try:
-            # Try JSON format first
-            print(f"Trying JSON format: {' '.join(cmd_json)}")
-            result = subprocess.run(cmd_json, capture_output=True, text=True, timeout=120)
-            
-            if result.returncode == 0:
-                print(f"MTR returned successfully. Output length: {len(result.stdout)} chars")
-                print(f"First 200 chars: {result.stdout[:200]}")
-                
-                try:
-                    json_data = json.loads(result.stdout)
-                    print("Successfully parsed JSON output")
-                    return json_data
-                except json.JSONDecodeError as e:
-                    print(f"JSON parsing failed: {e}")
-                    print("This might mean MTR was compiled without JSON support")
-            else:
-                print(f"JSON command failed with return code {result.returncode}")
-                if result.stderr:
-                    print(f"STDERR: {result.stderr}")
-            
-            # Fall back to text format
-            print(f"Using text format: {' '.join(cmd_text)}")
-            result = subprocess.run(cmd_text, capture_output=True, text=True, timeout=120)
-            
-            if result.returncode != 0:
-                print(f"MTR command failed with return code {result.returncode}")
-                print(f"STDERR: {result.stderr}")
-                sys.exit(1)
-                
-            print("Successfully got text output, parsing...")
-            return self.parse_mtr_text_output(result.stdout)
-            
+            logger.debug("Running: %s", ' '.join(cmd))
+            # Keep stdout as bytes: the JSON parser takes them without a decode round trip
+            result = subprocess.run(cmd, capture_output=True, timeout=120)
         except subprocess.TimeoutExpired:
-            print("MTR command timed out")
+            logger.error("MTR command timed out")
             sys.exit(1)
         except FileNotFoundError:
-            print("MTR command not found. Please install mtr package.")
+            logger.error("MTR command not found. Please install mtr package.")
+            sys.exit(1)
+        
+        if result.returncode != 0:
+            logger.error("MTR command failed with return code %d: %s",
+                         result.returncode, result.stderr.decode(errors='replace'))
+            sys.exit(1)
+        
+        try:
+            return self.parse_mtr_output(result.stdout, output_format)
+        except ValueError as e:
+            logger.error("Failed to parse mtr %s output: %s", output_format, e)
             sys.exit(1)
 
-    def parse_mtr_text_output(self, text_output: str) -> Dict[str, Any]:
-        """Parse traditional MTR text output"""
-        lines = text_output.strip().split('\n')
-        hubs = []
+    async def _run_command_async(self, cmd: List[str]):
+        """Run a command without blocking the event loop"""
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=120)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise
+        return proc.returncode, stdout, stderr
+
+    async def run_mtr_async(self) -> Dict[str, Any]:
+        """Run mtr on the event loop; raises RuntimeError instead of exiting"""
+        output_format = mtr_output_format()
+        cmd = self.build_mtr_command(output_format)
+        
+        try:
+            logger.debug("[%s] Running: %s", self.probe_name, ' '.join(cmd))
+            returncode, stdout, stderr = await self._run_command_async(cmd)
+        except asyncio.TimeoutError:
+            raise RuntimeError("MTR command timed out")
+        except FileNotFoundError:
+            raise RuntimeError("MTR command not found. Please install mtr package.")
         
-        print(f"Parsing {len(lines)} lines of MTR output...")
+        if returncode != 0:
+            raise RuntimeError(f"MTR command failed with return code {returncode}: "
+                               f"{stderr.decode(errors='replace')}")
         
-        # Find the data lines (skip header)
-        for line in lines:
-            line = line.strip()
-            if not line:
+        try:
+            return self.parse_mtr_output(stdout, output_format)
+        except ValueError as e:
+            raise RuntimeError(f"Failed to parse mtr {output_format} output: {e}")
+
+    def parse_mtr_csv_output(self, csv_output: bytes) -> Dict[str, Any]:
+        """Parse `mtr --csv` output with the C csv reader"""
+        hubs = []
+        columns = CSV_DEFAULT_COLUMNS
+        
+        for row in csv.reader(csv_output.decode().splitlines()):
+            if not row:
                 continue
-                
-            # Skip header lines
-            if line.startswith('Start:') or line.startswith('HOST:'):
+            if row[0] == 'Mtr_Version':
+                # Map columns by header name; the layout differs between mtr versions
+                header = {name.strip(): i for i, name in enumerate(row)}
+                columns = {name: header.get(name, i) for name, i in CSV_DEFAULT_COLUMNS.items()}
                 continue
-                
-            # Parse hop lines like: "  1.|-- _gateway     0.0%    10    1.6   1.6   1.6   1.8   0.1"
-            if '|--' in line or ('|' in line and not line.startswith('|')):
-                # Split on whitespace but be more careful
-                parts = line.split()
-                print(f"Parsing line: {line}")
-                print(f"Split into {len(parts)} parts: {parts}")
-                
-                if len(parts) >= 7:
-                    try:
-                        # Extract hop number - it's before the first dot
-                        hop_str = parts[0].split('.')[0].strip()
-                        hop_num = int(hop_str)
-                        
-                        # Host is the second part
-                        host = parts[1] if parts[1] != '???' else f"hop_{hop_num}"
-                        
-                        # Find the percentage - it should end with %
-                        loss_pct = 0.0
-                        loss_idx = -1
-                        for i, part in enumerate(parts):
-                            if part.endswith('%'):
-                                loss_pct = float(part.rstrip('%'))
-                                loss_idx = i
-                                break
-                        
-                        if loss_idx == -1:
-                            print(f"Warning: Could not find loss% in line: {line}")
-                            continue
-                            
-                        # The numeric values should be after the loss%
-                        numeric_parts = parts[loss_idx + 1:]
-                        if len(numeric_parts) >= 5:
-                            sent = int(numeric_parts[0])
-                            last = float(numeric_parts[1])
-                            avg = float(numeric_parts[2])
-                            best = float(numeric_parts[3])
-                            worst = float(numeric_parts[4])
-                            stddev = float(numeric_parts[5]) if len(numeric_parts) > 5 else 0.0
-                        else:
-                            print(f"Warning: Not enough numeric values in line: {line}")
-                            continue
-                        
-                        hub = {
-                            'count': hop_num,
-                            'host': host,
-                            'Loss%': loss_pct,
-                            'Snt': sent,
-                            'Last': last,
-                            'Avg': avg,
-                            'Best': best,
-                            'Wrst': worst,
-                            'StDev': stddev
-                        }
-                        hubs.append(hub)
-                        print(f"Successfully parsed hop {hop_num}: {host}")
-                        
-                    except (ValueError, IndexError) as e:
-                        print(f"Warning: Could not parse line: {line} - {e}")
-                        continue
-        
-        print(f"Successfully parsed {len(hubs)} hops")
+            
+            if len(row) <= max(columns.values()):
+                raise ValueError(f"short CSV row: {row}")
+            hop_num = int(row[columns['Hop']])
+            host = row[columns['Ip']]
+            hubs.append({
+                'count': hop_num,
+                'host': host if host != '???' else f"hop_{hop_num}",
+                'Loss%': float(row[columns['Loss%']].rstrip('%')),
+                'Snt': int(row[columns['Snt']]),
+                'Last': float(row[columns['Last']]),
+                'Avg': float(row[columns['Avg']]),
+                'Best': float(row[columns['Best']]),
+                'Wrst': float(row[columns['Wrst']]),
+                'StDev': float(row[columns['StDev']])
+            })
+        
+        logger.debug("Parsed %d hops from CSV output", len(hubs))
+        return {'report': {'hubs': hubs}}
+
+    def parse_mtr_text_output(self, text_output: bytes) -> Dict[str, Any]:
+        """Parse traditional MTR text output, straight from mtr's stdout bytes"""
+        hubs = []
+        
+        # One compiled match per line; header and blank lines simply don't match
+        for match in filter(None, map(HOP_RE.match, text_output.splitlines())):
+            hop, host, loss, sent, last, avg, best, worst, stddev = match.groups()
+            hop_num = int(hop)
+            hubs.append({
+                'count': hop_num,
+                'host': host.decode(errors='replace') if host != b'???' else f"hop_{hop_num}",
+                'Loss%': float(loss),
+                'Snt': int(sent),
+                'Last': float(last),
+                'Avg': float(avg),
+                'Best': float(best),
+                'Wrst': float(worst),
+                'StDev': float(stddev) if stddev else 0.0
+            })
+        
+        logger.debug("Parsed %d hops from text output", len(hubs))
         return {'report': {'hubs': hubs}}
 
     def parse_mtr_data(self, mtr_data: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Parse MTR JSON data and extract metrics"""
-        hops = []
+        # Validate the structure once; mtr's hub schema is stable, so index directly
+        report = mtr_data.get('report')
+        if not isinstance(report, dict) or 'hubs' not in report:
+            logger.warning("Invalid MTR data structure")
+            return []
         
-        if 'report' not in mtr_data or 'hubs' not in mtr_data['report']:
-            print("Invalid MTR data structure")
+        try:
+            return [
+                {
+                    'hop': hub['count'],
+                    'host': hub['host'],
+                    'loss_percent': hub['Loss%'],
+                    'sent': hub['Snt'],
+                    'last_ms': hub['Last'],
+                    'avg_ms': hub['Avg'],
+                    'best_ms': hub['Best'],
+                    'worst_ms': hub['Wrst'],
+                    'stddev_ms': hub['StDev'],  # This is our jitter metric
+                }
+                for hub in report['hubs']
+            ]
+        except KeyError as e:
+            logger.warning("MTR hub is missing field %s", e)
             return []
-            
-        for hub in mtr_data['report']['hubs']:
-            hop_data = {
-                'hop': hub.get('count', 0),
-                'host': hub.get('host', 'unknown'),
-                'loss_percent': hub.get('Loss%', 0.0),
-                'sent': hub.get('Snt', 0),
-                'last_ms': hub.get('Last', 0.0),
-                'avg_ms': hub.get('Avg', 0.0),
-                'best_ms': hub.get('Best', 0.0),
-                'worst_ms': hub.get('Wrst', 0.0),
-                'stddev_ms': hub.get('StDev', 0.0),  # This is our jitter metric
-            }
-            hops.append(hop_data)
-            
-        return hops
 
     def calculate_path_health_summary(self, hops: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Calculate path health summary metrics"""
         if not hops:
             return {}
         
-        # Filter out hops with 100% loss (like ??? hops in github path)
-        valid_hops = [hop for hop in hops if hop['loss_percent'] < 100.0]
-        
-        if not valid_hops:
+        # One pass over the path; hops with 100% loss (like ??? hops in github path)
+        # only count towards the max loss, not the averages or RTT spread
+        total_loss = 0.0
+        valid_count = 0
+        loss_sum = 0.0
+        jitter_sum = 0.0
+        max_jitter = 0.0
+        rtt_min = float('inf')
+        rtt_max = float('-inf')
+        for hop in hops:
+            loss = hop['loss_percent']
+            if loss > total_loss:
+                total_loss = loss  # Use max loss along path
+            if loss >= 100.0:
+                continue
+            valid_count += 1
+            loss_sum += loss
+            jitter = hop['stddev_ms']
+            jitter_sum += jitter
+            if jitter > max_jitter:
+                max_jitter = jitter
+            rtt = hop['avg_ms']
+            if rtt < rtt_min:
+                rtt_min = rtt
+            if rtt > rtt_max:
+                rtt_max = rtt
+        
+        if not valid_count:
             return {}
         
-        # Total path metrics
-        total_loss = max(hop['loss_percent'] for hop in hops)  # Use max loss along path
-        avg_loss = sum(hop['loss_percent'] for hop in valid_hops) / len(valid_hops)
-        
-        # Round trip delay (end-to-end)
-        end_to_end_rtt = hops[-1]['avg_ms'] if hops else 0.0
+        avg_loss = loss_sum / valid_count
         
-        # Round trip jitter (end-to-end)
-        end_to_end_jitter = hops[-1]['stddev_ms'] if hops else 0.0
+        # Round trip delay and jitter (end-to-end)
+        end_to_end_rtt = hops[-1]['avg_ms']
+        end_to_end_jitter = hops[-1]['stddev_ms']
         
         # Path stability (based on jitter across all hops)
-        avg_jitter = sum(hop['stddev_ms'] for hop in valid_hops) / len(valid_hops)
-        max_jitter = max(hop['stddev_ms'] for hop in valid_hops)
+        avg_jitter = jitter_sum / valid_count
         
         # Path consistency (RTT variance across hops)
-        rtts = [hop['avg_ms'] for hop in valid_hops]
-        rtt_variance = max(rtts) - min(rtts) if len(rtts) > 1 else 0.0
+        rtt_variance = rtt_max - rtt_min if valid_count > 1 else 0.0
         
         # Health score calculation (0-100, higher is better)
         loss_penalty = total_loss * 2  # 2 points per 1% loss
@@ -245,7 +334,7 @@ class MTRPrometheusExporter:
         
         return {
             'hop_count': len(hops),
-            'valid_hops': len(valid_hops),
+            'valid_hops': valid_count,
             'total_loss_percent': total_loss,
             'avg_loss_percent': avg_loss,
             'end_to_end_rtt_ms': end_to_end_rtt,
@@ -257,178 +346,113 @@ class MTRPrometheusExporter:
             'health_status': health_status
         }
 
-    def build_labels(self, extra_labels: Optional[Dict[str, str]] = None) -> str:
-        """Build label string for Prometheus metrics"""
-        labels = {}
-        
-        # Add custom labels
-        labels.update(self.custom_labels)
-        
-        # Add target and probe info
-        labels['target'] = self.target
-        labels['probe'] = self.probe_name
-        
-        # Add any extra labels
-        if extra_labels:
-            labels.update(extra_labels)
-        
-        # Format as Prometheus labels
-        label_parts = [f'{key}="{value}"' for key, value in labels.items()]
-        return ','.join(label_parts)
-
-    def generate_prometheus_metrics(self, hops: List[Dict[str, Any]]) -> str:
-        """Generate Prometheus format metrics"""
-        metrics = []
-        
+    def iter_prometheus_lines(self, hops: List[Dict[str, Any]]) -> Iterator[str]:
+        """Yield Prometheus format metric text in newline-terminated chunks"""
         # Base labels for metrics
-        base_labels = self.build_labels()
+        base_labels = self._base_labels_str
         
         # Calculate path health summary
         summary = self.calculate_path_health_summary(hops)
         
+        # Per-hop label strings, formatted once and shared by every hop family
+        hop_labels = [f'{base_labels},hop="{hop["hop"]}"' for hop in hops]
+        
         # Add metadata
-        metrics.append(f"# HELP mtr_info MTR trace information")
-        metrics.append(f"# TYPE mtr_info gauge")
-        metrics.append(f'mtr_info{{{base_labels},port="{self.port}"}} 1')
-        metrics.append("")
+        yield "# HELP mtr_info MTR trace information\n"
+        yield "# TYPE mtr_info gauge\n"
+        yield f'mtr_info{{{base_labels},port="{self.port}"}} 1\n'
+        yield "\n"
         
         # Path Health Summary Metrics
         if summary:
-            metrics.append("# HELP mtr_path_health_score Overall path health score (0-100, higher is better)")
-            metrics.append("# TYPE mtr_path_health_score gauge")
-            metrics.append(f'mtr_path_health_score{{{base_labels}}} {summary["health_score"]}')
-            metrics.append("")
+            yield "# HELP mtr_path_health_score Overall path health score (0-100, higher is better)\n"
+            yield "# TYPE mtr_path_health_score gauge\n"
+            yield f'mtr_path_health_score{{{base_labels}}} {summary["health_score"]}\n'
+            yield "\n"
             
-            metrics.append("# HELP mtr_path_rtt_variance_ms RTT variance across the path")
-            metrics.append("# TYPE mtr_path_rtt_variance_ms gauge")
-            metrics.append(f'mtr_path_rtt_variance_ms{{{base_labels}}} {summary["rtt_variance_ms"]}')
-            metrics.append("")
+            yield "# HELP mtr_path_rtt_variance_ms RTT variance across the path\n"
+            yield "# TYPE mtr_path_rtt_variance_ms gauge\n"
+            yield f'mtr_path_rtt_variance_ms{{{base_labels}}} {summary["rtt_variance_ms"]}\n'
+            yield "\n"
             
-            metrics.append("# HELP mtr_path_avg_jitter_ms Average jitter across all valid hops")
-            metrics.append("# TYPE mtr_path_avg_jitter_ms gauge")
-            metrics.append(f'mtr_path_avg_jitter_ms{{{base_labels}}} {summary["avg_jitter_ms"]}')
-            metrics.append("")
+            yield "# HELP mtr_path_avg_jitter_ms Average jitter across all valid hops\n"
+            yield "# TYPE mtr_path_avg_jitter_ms gauge\n"
+            yield f'mtr_path_avg_jitter_ms{{{base_labels}}} {summary["avg_jitter_ms"]}\n'
+            yield "\n"
             
-            metrics.append("# HELP mtr_path_max_jitter_ms Maximum jitter across all valid hops")
-            metrics.append("# TYPE mtr_path_max_jitter_ms gauge")
-            metrics.append(f'mtr_path_max_jitter_ms{{{base_labels}}} {summary["max_jitter_ms"]}')
-            metrics.append("")
+            yield "# HELP mtr_path_max_jitter_ms Maximum jitter across all valid hops\n"
+            yield "# TYPE mtr_path_max_jitter_ms gauge\n"
+            yield f'mtr_path_max_jitter_ms{{{base_labels}}} {summary["max_jitter_ms"]}\n'
+            yield "\n"
             
-            metrics.append("# HELP mtr_path_total_loss_percent Maximum packet loss percentage along the path")
-            metrics.append("# TYPE mtr_path_total_loss_percent gauge")
-            metrics.append(f'mtr_path_total_loss_percent{{{base_labels}}} {summary["total_loss_percent"]}')
-            metrics.append("")
-        
-        # Packet loss percentage per hop
-        metrics.append("# HELP mtr_loss_percent Packet loss percentage per hop")
-        metrics.append("# TYPE mtr_loss_percent gauge")
-        for hop in hops:
-            hop_labels = self.build_labels({'hop': str(hop['hop']), 'host': hop['host']})
-            metrics.append(f'mtr_loss_percent{{{hop_labels}}} {hop["loss_percent"]}')
-        metrics.append("")
-        
-        # Packets sent per hop
-        metrics.append("# HELP mtr_packets_sent Total packets sent per hop")
-        metrics.append("# TYPE mtr_packets_sent counter")
-        for hop in hops:
-            hop_labels = self.build_labels({'hop': str(hop['hop']), 'host': hop['host']})
-            metrics.append(f'mtr_packets_sent{{{hop_labels}}} {hop["sent"]}')
-        metrics.append("")
-        
-        # Last round trip time
-        metrics.append("# HELP mtr_last_rtt_ms Last round trip time in milliseconds")
-        metrics.append("# TYPE mtr_last_rtt_ms gauge")
-        for hop in hops:
-            hop_labels = self.build_labels({'hop': str(hop['hop']), 'host': hop['host']})
-            metrics.append(f'mtr_last_rtt_ms{{{hop_labels}}} {hop["last_ms"]}')
-        metrics.append("")
-        
-        # Average round trip time
-        metrics.append("# HELP mtr_avg_rtt_ms Average round trip time in milliseconds")
-        metrics.append("# TYPE mtr_avg_rtt_ms gauge")
-        for hop in hops:
-            hop_labels = self.build_labels({'hop': str(hop['hop']), 'host': hop['host']})
-            metrics.append(f'mtr_avg_rtt_ms{{{hop_labels}}} {hop["avg_ms"]}')
-        metrics.append("")
-        
-        # Best round trip time
-        metrics.append("# HELP mtr_best_rtt_ms Best round trip time in milliseconds")
-        metrics.append("# TYPE mtr_best_rtt_ms gauge")
-        for hop in hops:
-            hop_labels = self.build_labels({'hop': str(hop['hop']), 'host': hop['host']})
-            metrics.append(f'mtr_best_rtt_ms{{{hop_labels}}} {hop["best_ms"]}')
-        metrics.append("")
-        
-        # Worst round trip time
-        metrics.append("# HELP mtr_worst_rtt_ms Worst round trip time in milliseconds")
-        metrics.append("# TYPE mtr_worst_rtt_ms gauge")
-        for hop in hops:
-            hop_labels = self.build_labels({'hop': str(hop['hop']), 'host': hop['host']})
-            metrics.append(f'mtr_worst_rtt_ms{{{hop_labels}}} {hop["worst_ms"]}')
-        metrics.append("")
-        
-        # Jitter (standard deviation)
-        metrics.append("# HELP mtr_jitter_ms Jitter (standard deviation) in milliseconds")
-        metrics.append("# TYPE mtr_jitter_ms gauge")
-        for hop in hops:
-            hop_labels = self.build_labels({'hop': str(hop['hop']), 'host': hop['host']})
-            metrics.append(f'mtr_jitter_ms{{{hop_labels}}} {hop["stddev_ms"]}')
-        metrics.append("")
+            yield "# HELP mtr_path_total_loss_percent Maximum packet loss percentage along the path\n"
+            yield "# TYPE mtr_path_total_loss_percent gauge\n"
+            yield f'mtr_path_total_loss_percent{{{base_labels}}} {summary["total_loss_percent"]}\n'
+            yield "\n"
+        
+        # Hop hostnames churn (ECMP, load balancers, unresolved hops), so they live
+        # only on this info series instead of multiplying every per-hop series
+        yield ("# HELP mtr_hop_info Hostname seen at each hop\n"
+               "# TYPE mtr_hop_info gauge\n"
+               + ''.join([f'mtr_hop_info{{{labels},host="{_esc(hop["host"])}"}} 1\n'
+                          for labels, hop in zip(hop_labels, hops)])
+               + "\n")
+        
+        # Per-hop metric families, each joined into one chunk so the writer sees
+        # a handful of large writes rather than one small write per series
+        for name, help_text, metric_type, key in HOP_METRIC_FAMILIES:
+            yield (f"# HELP {name} {help_text}\n"
+                   f"# TYPE {name} {metric_type}\n"
+                   + ''.join([f'{name}{{{labels}}} {hop[key]}\n'
+                              for labels, hop in zip(hop_labels, hops)])
+                   + "\n")
         
         # Total hop count
-        metrics.append("# HELP mtr_hop_count Total number of hops to target")
-        metrics.append("# TYPE mtr_hop_count gauge")
+        yield "# HELP mtr_hop_count Total number of hops to target\n"
+        yield "# TYPE mtr_hop_count gauge\n"
         if hops:
-            metrics.append(f'mtr_hop_count{{{base_labels}}} {len(hops)}')
-        metrics.append("")
+            yield f'mtr_hop_count{{{base_labels}}} {len(hops)}\n'
+        yield "\n"
         
         # End-to-end metrics (using last hop)
         if hops:
             last_hop = hops[-1]
-            metrics.append("# HELP mtr_end_to_end_loss_percent End-to-end packet loss percentage")
-            metrics.append("# TYPE mtr_end_to_end_loss_percent gauge")
-            metrics.append(f'mtr_end_to_end_loss_percent{{{base_labels}}} {last_hop["loss_percent"]}')
-            metrics.append("")
+            yield "# HELP mtr_end_to_end_loss_percent End-to-end packet loss percentage\n"
+            yield "# TYPE mtr_end_to_end_loss_percent gauge\n"
+            yield f'mtr_end_to_end_loss_percent{{{base_labels}}} {last_hop["loss_percent"]}\n'
+            yield "\n"
             
-            metrics.append("# HELP mtr_end_to_end_avg_rtt_ms End-to-end average round trip time")
-            metrics.append("# TYPE mtr_end_to_end_avg_rtt_ms gauge")
-            metrics.append(f'mtr_end_to_end_avg_rtt_ms{{{base_labels}}} {last_hop["avg_ms"]}')
-            metrics.append("")
+            yield "# HELP mtr_end_to_end_avg_rtt_ms End-to-end average round trip time\n"
+            yield "# TYPE mtr_end_to_end_avg_rtt_ms gauge\n"
+            yield f'mtr_end_to_end_avg_rtt_ms{{{base_labels}}} {last_hop["avg_ms"]}\n'
+            yield "\n"
             
-            metrics.append("# HELP mtr_end_to_end_jitter_ms End-to-end jitter")
-            metrics.append("# TYPE mtr_end_to_end_jitter_ms gauge")
-            metrics.append(f'mtr_end_to_end_jitter_ms{{{base_labels}}} {last_hop["stddev_ms"]}')
-            metrics.append("")
+            yield "# HELP mtr_end_to_end_jitter_ms End-to-end jitter\n"
+            yield "# TYPE mtr_end_to_end_jitter_ms gauge\n"
+            yield f'mtr_end_to_end_jitter_ms{{{base_labels}}} {last_hop["stddev_ms"]}\n'
+            yield "\n"
         
         # Timestamp
-        metrics.append("# HELP mtr_last_run_timestamp_ms Timestamp of last MTR run")
-        metrics.append("# TYPE mtr_last_run_timestamp_ms gauge")
-        metrics.append(f'mtr_last_run_timestamp_ms{{{base_labels}}} {self.timestamp}')
-        
-        return "\n".join(metrics)
+        yield "# HELP mtr_last_run_timestamp_ms Timestamp of last MTR run\n"
+        yield "# TYPE mtr_last_run_timestamp_ms gauge\n"
+        yield f'mtr_last_run_timestamp_ms{{{base_labels}}} {self.timestamp}\n'
 
     def export_to_file(self, output_file: str):
         """Run MTR and export metrics to file"""
-        print(f"Running MTR to {self.target}:{self.port} (probe: {self.probe_name})...")
+        logger.info("Running MTR to %s:%s (probe: %s)", self.target, self.port, self.probe_name)
         mtr_data = self.run_mtr()
         
-        print("Parsing MTR data...")
         hops = self.parse_mtr_data(mtr_data)
         
         if not hops:
-            print("No hop data found")
+            logger.error("No hop data found")
             sys.exit(1)
             
-        print(f"Found {len(hops)} hops")
-        
-        print("Generating Prometheus metrics...")
-        prometheus_metrics = self.generate_prometheus_metrics(hops)
+        logger.debug("Found %d hops", len(hops))
         
-        print(f"Writing metrics to {output_file}...")
-        with open(output_file, 'w') as f:
-            f.write(prometheus_metrics)
+        write_atomic(output_file, self.iter_prometheus_lines(hops))
             
-        print(f"Successfully exported metrics to {output_file}")
+        logger.info("Exported metrics to %s", output_file)
         
         # Print path health summary
         summary = self.calculate_path_health_summary(hops)
@@ -444,19 +468,52 @@ class MTRPrometheusExporter:
         
         # Print detailed per-hop summary
         print(f"\n=== DETAILED HOP ANALYSIS for {self.probe_name} ===")
-        for hop in hops:
-            status = "❌" if hop['loss_percent'] == 100.0 else "⚠️" if hop['loss_percent'] > 0 else "✅"
-            print(f"  {status} Hop {hop['hop']:2d}: {hop['host']:30s} "
-                  f"Loss: {hop['loss_percent']:5.1f}% "
-                  f"Avg: {hop['avg_ms']:7.2f}ms "
-                  f"Jitter: {hop['stddev_ms']:6.2f}ms")
+        write_hop_table(hops)
+
+
+def _format_hop_line(hop: Dict[str, Any]) -> str:
+    """Format one row of the per-hop status table"""
+    status = "❌" if hop['loss_percent'] == 100.0 else "⚠️" if hop['loss_percent'] > 0 else "✅"
+    return (f"  {status} Hop {hop['hop']:2d}: {hop['host']:30s} "
+            f"Loss: {hop['loss_percent']:5.1f}% "
+            f"Avg: {hop['avg_ms']:7.2f}ms "
+            f"Jitter: {hop['stddev_ms']:6.2f}ms")
+
+
+def write_hop_table(hops: List[Dict[str, Any]]):
+    """Print the per-hop status table with a single write"""
+    sys.stdout.write('\n'.join(map(_format_hop_line, hops)) + '\n')
+
+
+def write_atomic(output_file: str, lines: Iterable[str]):
+    """Write lines to a temp file, fsync it and os.replace it over output_file"""
+    temp_file = output_file + ".tmp"
+    try:
+        with open(temp_file, 'w', buffering=1 << 16) as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        # Scrapers see either the old file or the complete new one, never a partial write
+        os.replace(temp_file, output_file)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
+def iter_probe_lines(probe_hops: List[Tuple[MTRPrometheusExporter, List[Dict[str, Any]]]]) -> Iterator[str]:
+    """Yield the metric lines of every probe, with a blank line between probes"""
+    for i, (exporter, hops) in enumerate(probe_hops):
+        if i:
+            yield "\n"
+        yield from exporter.iter_prometheus_lines(hops)
 
 
 def load_config(config_file: str) -> Dict[str, Any]:
     """Load configuration from YAML file"""
     try:
         with open(config_file, 'r') as f:
-            return yaml.safe_load(f)
+            return yaml.load(f, Loader=_YamlLoader)
     except FileNotFoundError:
         print(f"Configuration file not found: {config_file}")
         sys.exit(1)
@@ -465,6 +522,19 @@ def load_config(config_file: str) -> Dict[str, Any]:
         sys.exit(1)
 
 
+async def run_probes_async(exporters: List[MTRPrometheusExporter]) -> List[Any]:
+    """Run mtr for all exporters concurrently, returning results or exceptions in order"""
+    # Cap the number of mtr processes in flight so large configs don't flood the host
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_PROBES)
+    
+    async def run_one(exporter: MTRPrometheusExporter) -> Dict[str, Any]:
+        async with semaphore:
+            return await exporter.run_mtr_async()
+    
+    return await asyncio.gather(*(run_one(exporter) for exporter in exporters),
+                                return_exceptions=True)
+
+
 def run_config_mode(config_file: str):
     """Run multiple probes based on configuration file"""
     config = load_config(config_file)
@@ -483,8 +553,7 @@ def run_config_mode(config_file: str):
         print("No probes defined in configuration file")
         sys.exit(1)
     
-    all_metrics = []
-    
+    exporters = []
     for probe_config in probes:
         probe_name = probe_config.get('name', 'unknown')
         target = probe_config.get('target')
@@ -495,23 +564,33 @@ def run_config_mode(config_file: str):
             print(f"Skipping probe '{probe_name}': no target specified")
             continue
         
-        print(f"\n=== Running probe: {probe_name} ===")
-        
-        exporter = MTRPrometheusExporter(
+        exporters.append(MTRPrometheusExporter(
             target=target,
             port=port,
             count=mtr_cycles,
             probe_name=probe_name,
             custom_labels=labels
-        )
+        ))
+    
+    # Run every probe concurrently; wall time is the slowest probe, not the sum
+    print(f"\n=== Running {len(exporters)} probes concurrently ===")
+    results = asyncio.run(run_probes_async(exporters))
+    
+    probe_hops = []
+    
+    for exporter, mtr_data in zip(exporters, results):
+        probe_name = exporter.probe_name
+        print(f"\n=== Results for probe: {probe_name} ===")
+        
+        if isinstance(mtr_data, Exception):
+            print(f"❌ Probe '{probe_name}' failed: {mtr_data}")
+            continue
         
         # Generate metrics
-        mtr_data = exporter.run_mtr()
         hops = exporter.parse_mtr_data(mtr_data)
         
         if hops:
-            metrics = exporter.generate_prometheus_metrics(hops)
-            all_metrics.append(metrics)
+            probe_hops.append((exporter, hops))
             
             # Print path health summary
             summary = exporter.calculate_path_health_summary(hops)
@@ -526,43 +605,41 @@ def run_config_mode(config_file: str):
             
             # Print condensed per-hop summary
             print(f"\nDetailed hops for {probe_name}:")
-            for hop in hops:
-                status = "❌" if hop['loss_percent'] == 100.0 else "⚠️" if hop['loss_percent'] > 0 else "✅"
-                print(f"  {status} Hop {hop['hop']:2d}: {hop['host']:30s} "
-                      f"Loss: {hop['loss_percent']:5.1f}% "
-                      f"Avg: {hop['avg_ms']:7.2f}ms "
-                      f"Jitter: {hop['stddev_ms']:6.2f}ms")
+            write_hop_table(hops)
         else:
             print(f"❌ No hop data found for probe '{probe_name}'")
     
-    if not all_metrics:
+    if not probe_hops:
         print("No successful probe results")
         sys.exit(1)
     
     # Write combined metrics to file
     output_file = os.path.join(output_dir, "mtr_all_probes.prom")
-    temp_file = output_file + ".tmp"
     
     try:
-        with open(temp_file, 'w') as f:
-            f.write('\n\n'.join(all_metrics))
-        
-        # Atomic move
-        os.rename(temp_file, output_file)
+        write_atomic(output_file, iter_probe_lines(probe_hops))
         print(f"\n=== Successfully wrote combined metrics to {output_file} ===")
     except Exception as e:
         print(f"Failed to write output file: {e}")
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
         sys.exit(1)
 
 
+def setup_logging(log_level: str):
+    """Send diagnostics to stderr so stdout keeps the summary report"""
+    logging.basicConfig(level=getattr(logging, log_level),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+
 def main():
     # Check if --config is in args, if so use config mode
     if '--config' in sys.argv:
         parser = argparse.ArgumentParser(description='MTR to Prometheus Exporter - Config Mode')
         parser.add_argument('--config', required=True, help='Configuration file path')
+        parser.add_argument('--log-level', default='WARNING',
+                            choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                            help='Log level (default: WARNING)')
         args = parser.parse_args()
+        setup_logging(args.log_level)
         
         run_config_mode(args.config)
         return
@@ -576,8 +653,12 @@ def main():
     parser.add_argument('-o', '--output', default='mtr_metrics.prom', help='Output file (default: mtr_metrics.prom)')
     parser.add_argument('--probe-name', default='default', help='Probe name for metrics (default: default)')
     parser.add_argument('--label', action='append', help='Add custom label in key=value format')
+    parser.add_argument('--log-level', default='WARNING',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='Log level (default: WARNING)')
     
     args = parser.parse_args()
+    setup_logging(args.log_level)
     
     # Parse custom labels
     custom_labels = {}
@@ -4,15 +4,94 @@ MTR to Prometheus Exporter
 Runs mtr against a target and exports metrics in Prometheus format
 """
 
+import asyncio
+import functools
+import os
+import re
 import subprocess
-import json
+import logging
 import time
 import argparse
 import sys
-from datetime import datetime
-from typing import Dict, List, Any
+import tempfile
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, NamedTuple, Tuple
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+log = logging.getLogger("mtr_exporter")
+
+class Hop(NamedTuple):
+    """One hop of a trace, as parsed from mtr's report"""
+    hop: int
+    host: str
+    loss_percent: float
+    sent: int
+    last_ms: float
+    avg_ms: float
+    best_ms: float
+    worst_ms: float
+    stddev_ms: float
+
+# Per-hop metric families: (name, help text, type, Hop field)
+HOP_METRIC_FAMILIES = [
+    ('mtr_loss_percent', 'Packet loss percentage per hop', 'gauge', 'loss_percent'),
+    ('mtr_packets_sent', 'Total packets sent per hop', 'counter', 'sent'),
+    ('mtr_last_rtt_ms', 'Last round trip time in milliseconds', 'gauge', 'last_ms'),
+    ('mtr_avg_rtt_ms', 'Average round trip time in milliseconds', 'gauge', 'avg_ms'),
+    ('mtr_best_rtt_ms', 'Best round trip time in milliseconds', 'gauge', 'best_ms'),
+    ('mtr_worst_rtt_ms', 'Worst round trip time in milliseconds', 'gauge', 'worst_ms'),
+    ('mtr_jitter_ms', 'Jitter (standard deviation) in milliseconds', 'gauge', 'stddev_ms'),
+]
+
+# Format spec for RTT values: fixed millisecond precision instead of float repr's 17 digits
+_RTT_FORMAT = '.3f'
+
+# HELP/TYPE header, sample prefix, Hop field index and value format spec of each family,
+# encoded once at import
+_HOP_FAMILY_OUTPUT = [
+    (f"# HELP {name} {help_text}\n# TYPE {name} {metric_type}\n".encode(),
+     name.encode() + b'{',
+     Hop._fields.index(field),
+     _RTT_FORMAT if field.endswith('_ms') else '')
+    for name, help_text, metric_type, field in HOP_METRIC_FAMILIES
+]
+
+# Hop line of `mtr --report`, e.g.
+#   "  1.|-- _gateway     0.0%    10    1.6   1.6   1.6   1.8   0.1"
+# Matched with finditer over the whole report, so fields are separated by [ \t]
+# only and a match can never run on into the next line
+HOP_RE = re.compile(
+    rb'^[ \t]*(\d+)\.[ \t]*[|`]--[ \t]+(\S+)[ \t]+([\d.]+)%[ \t]+(\d+)'
+    rb'[ \t]+([\d.]+)[ \t]+([\d.]+)[ \t]+([\d.]+)[ \t]+([\d.]+)(?:[ \t]+([\d.]+))?',
+    re.MULTILINE
+)
+
+# Command prefixes for the two mtr output formats
+_MTR_JSON = ('mtr', '-j')
+_MTR_REPORT = ('mtr', '--report')
+
+@functools.lru_cache(maxsize=1)
+def _mtr_supports_json() -> bool:
+    """Check once per process whether the installed mtr was built with JSON output"""
+    try:
+        result = subprocess.run(['mtr', '--help'], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return '--json' in result.stdout or '--json' in result.stderr
 
 class MTRPrometheusExporter:
+    # Series that depend only on the exporter's own fields, rendered once per instance
+    _INFO_TEMPLATE = ('# HELP mtr_info MTR trace information\n'
+                      '# TYPE mtr_info gauge\n'
+                      'mtr_info{{target="{target}",port="{port}"}} 1\n\n')
+    _TIMESTAMP_TEMPLATE = ('# HELP mtr_last_run_timestamp_ms Timestamp of last MTR run\n'
+                           '# TYPE mtr_last_run_timestamp_ms gauge\n'
+                           'mtr_last_run_timestamp_ms{{target="{target}"}} {timestamp}\n')
+    
     def __init__(self, target: str, port: int = 443, count: int = 10, interval: int = 1):
         self.target = target
         self.port = port
@@ -20,313 +99,285 @@ class MTRPrometheusExporter:
         self.interval = interval
         self.timestamp = int(time.time() * 1000)  # milliseconds
         
+        # The target label is identical on every series, so it is encoded once
+        self._target_label = f'target="{target}"'.encode()
+        self._info_block = self._INFO_TEMPLATE.format(target=target, port=port).encode()
+        self._timestamp_block = self._TIMESTAMP_TEMPLATE.format(
+            target=target, timestamp=self.timestamp).encode()
+        
+        # Everything after the output-format flag is fixed for this exporter
+        self._mtr_args = (
+            '--report-cycles', str(count),
+            '--interval', str(interval),
+            '--port', str(port),
+            target
+        )
+        
+    def build_mtr_command(self, use_json: bool) -> List[str]:
+        """Build the mtr command line for JSON or text report output"""
+        # -j conflicts with --report, so the two modes are mutually exclusive
+        return [*(_MTR_JSON if use_json else _MTR_REPORT), *self._mtr_args]
+
     def run_mtr(self) -> Dict[str, Any]:
         """Run mtr command and return parsed output"""
-        # Try JSON format first (note: -j conflicts with --report)
-        cmd_json = [
-            'mtr',
-            '-j',
-            '--report-cycles', str(self.count),
-            '--interval', str(self.interval),
-            '--port', str(self.port),
-            self.target
-        ]
-        
-        # Fallback to text format
-        cmd_text = [
-            'mtr',
-            '--report',
-            '--report-cycles', str(self.count),
-            '--interval', str(self.interval),
-            '--port', str(self.port),
-            self.target
-        ]
+        use_json = _mtr_supports_json()
+        cmd = self.build_mtr_command(use_json)
         
         try:
-            # Try JSON format first
-            print(f"Trying JSON format: {' '.join(cmd_json)}")
-            result = subprocess.run(cmd_json, capture_output=True, text=True, timeout=120)
-            
-            if result.returncode == 0:
-                print(f"MTR returned successfully. Output length: {len(result.stdout)} chars")
-                print(f"First 200 chars: {result.stdout[:200]}")
-                
-                try:
-                    json_data = json.loads(result.stdout)
-                    print("Successfully parsed JSON output")
-                    return json_data
-                except json.JSONDecodeError as e:
-                    print(f"JSON parsing failed: {e}")
-                    print("This might mean MTR was compiled without JSON support")
-            else:
-                print(f"JSON command failed with return code {result.returncode}")
-                if result.stderr:
-                    print(f"STDERR: {result.stderr}")
-            
-            # Fall back to text format
-            print(f"Using text format: {' '.join(cmd_text)}")
-            result = subprocess.run(cmd_text, capture_output=True, text=True, timeout=120)
-            
-            if result.returncode != 0:
-                print(f"MTR command failed with return code {result.returncode}")
-                print(f"STDERR: {result.stderr}")
-                sys.exit(1)
-                
-            print("Successfully got text output, parsing...")
-            return self.parse_mtr_text_output(result.stdout)
-            
+            log.debug("Running: %s", ' '.join(cmd))
+            # Bytes in: the JSON parser takes them directly, and the text path decodes once
+            result = subprocess.run(cmd, capture_output=True, timeout=120)
         except subprocess.TimeoutExpired:
-            print("MTR command timed out")
+            log.error("MTR command timed out")
             sys.exit(1)
         except FileNotFoundError:
-            print("MTR command not found. Please install mtr package.")
+            log.error("MTR command not found. Please install mtr package.")
+            sys.exit(1)
+        
+        if result.returncode != 0:
+            log.error("MTR command failed with return code %d: %s",
+                      result.returncode, result.stderr.decode('ascii', 'replace'))
+            sys.exit(1)
+        
+        try:
+            return self.parse_mtr_output(result.stdout, use_json)
+        except ValueError as e:
+            log.error("JSON parsing failed: %s", e)
             sys.exit(1)
 
-    def parse_mtr_text_output(self, text_output: str) -> Dict[str, Any]:
-        """Parse traditional MTR text output"""
-        lines = text_output.strip().split('\n')
-        hubs = []
+    async def run_mtr_async(self) -> Dict[str, Any]:
+        """Run mtr without blocking the event loop; raises RuntimeError on failure"""
+        use_json = _mtr_supports_json()
+        cmd = self.build_mtr_command(use_json)
+        
+        log.debug("Running: %s", ' '.join(cmd))
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            raise RuntimeError("MTR command not found. Please install mtr package.")
         
-        print(f"Parsing {len(lines)} lines of MTR output...")
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=120)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise RuntimeError("MTR command timed out")
         
-        # Find the data lines (skip header)
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Skip header lines
-            if line.startswith('Start:') or line.startswith('HOST:'):
-                continue
-                
-            # Parse hop lines like: "  1.|-- _gateway     0.0%    10    1.6   1.6   1.6   1.8   0.1"
-            if '|--' in line or ('|' in line and not line.startswith('|')):
-                # Split on whitespace but be more careful
-                parts = line.split()
-                print(f"Parsing line: {line}")
-                print(f"Split into {len(parts)} parts: {parts}")
-                
-                if len(parts) >= 7:
-                    try:
-                        # Extract hop number - it's before the first dot
-                        hop_str = parts[0].split('.')[0].strip()
-                        hop_num = int(hop_str)
-                        
-                        # Host is the second part
-                        host = parts[1] if parts[1] != '???' else f"hop_{hop_num}"
-                        
-                        # Find the percentage - it should end with %
-                        loss_pct = 0.0
-                        loss_idx = -1
-                        for i, part in enumerate(parts):
-                            if part.endswith('%'):
-                                loss_pct = float(part.rstrip('%'))
-                                loss_idx = i
-                                break
-                        
-                        if loss_idx == -1:
-                            print(f"Warning: Could not find loss% in line: {line}")
-                            continue
-                            
-                        # The numeric values should be after the loss%
-                        numeric_parts = parts[loss_idx + 1:]
-                        if len(numeric_parts) >= 5:
-                            sent = int(numeric_parts[0])
-                            last = float(numeric_parts[1])
-                            avg = float(numeric_parts[2])
-                            best = float(numeric_parts[3])
-                            worst = float(numeric_parts[4])
-                            stddev = float(numeric_parts[5]) if len(numeric_parts) > 5 else 0.0
-                        else:
-                            print(f"Warning: Not enough numeric values in line: {line}")
-                            continue
-                        
-                        hub = {
-                            'count': hop_num,
-                            'host': host,
-                            'Loss%': loss_pct,
-                            'Snt': sent,
-                            'Last': last,
-                            'Avg': avg,
-                            'Best': best,
-                            'Wrst': worst,
-                            'StDev': stddev
-                        }
-                        hubs.append(hub)
-                        print(f"Successfully parsed hop {hop_num}: {host}")
-                        
-                    except (ValueError, IndexError) as e:
-                        print(f"Warning: Could not parse line: {line} - {e}")
-                        continue
+        if proc.returncode != 0:
+            raise RuntimeError(f"MTR command failed with return code {proc.returncode}: "
+                               f"{stderr.decode('ascii', 'replace')}")
         
-        print(f"Successfully parsed {len(hubs)} hops")
+        try:
+            return self.parse_mtr_output(stdout, use_json)
+        except ValueError as e:
+            raise RuntimeError(f"JSON parsing failed: {e}")
+
+    def parse_mtr_output(self, stdout: bytes, use_json: bool) -> Dict[str, Any]:
+        """Parse raw mtr stdout; raises ValueError on malformed JSON"""
+        if not use_json:
+            return self.parse_mtr_text_output(stdout)
+        return _json_loads(stdout)
+
+    def parse_mtr_text_output(self, text_output: bytes) -> Dict[str, Any]:
+        """Parse traditional MTR text output from mtr's raw stdout bytes"""
+        hubs = []
+        
+        # One scan of the whole buffer in the regex engine; no per-line bytes objects
+        for match in HOP_RE.finditer(text_output):
+            hop, host, loss, sent, last, avg, best, worst, stddev = match.groups()
+            hop_num = int(hop)
+            hubs.append({
+                'count': hop_num,
+                'host': host.decode('ascii', 'replace') if host != b'???' else f"hop_{hop_num}",
+                'Loss%': float(loss),
+                'Snt': int(sent),
+                'Last': float(last),
+                'Avg': float(avg),
+                'Best': float(best),
+                'Wrst': float(worst),
+                'StDev': float(stddev) if stddev else 0.0
+            })
+        
+        log.debug("Parsed %d hops from text output", len(hubs))
         return {'report': {'hubs': hubs}}
 
-    def parse_mtr_data(self, mtr_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def parse_mtr_data(self, mtr_data: Dict[str, Any]) -> List[Hop]:
         """Parse MTR JSON data and extract metrics"""
-        hops = []
-        
         if 'report' not in mtr_data or 'hubs' not in mtr_data['report']:
-            print("Invalid MTR data structure")
+            log.error("Invalid MTR data structure")
             return []
             
-        for hub in mtr_data['report']['hubs']:
-            hop_data = {
-                'hop': hub.get('count', 0),
-                'host': hub.get('host', 'unknown'),
-                'loss_percent': hub.get('Loss%', 0.0),
-                'sent': hub.get('Snt', 0),
-                'last_ms': hub.get('Last', 0.0),
-                'avg_ms': hub.get('Avg', 0.0),
-                'best_ms': hub.get('Best', 0.0),
-                'worst_ms': hub.get('Wrst', 0.0),
-                'stddev_ms': hub.get('StDev', 0.0),  # This is our jitter metric
-            }
-            hops.append(hop_data)
-            
-        return hops
+        return [
+            Hop(
+                hop=hub.get('count', 0),
+                host=hub.get('host', 'unknown'),
+                loss_percent=hub.get('Loss%', 0.0),
+                sent=hub.get('Snt', 0),
+                last_ms=hub.get('Last', 0.0),
+                avg_ms=hub.get('Avg', 0.0),
+                best_ms=hub.get('Best', 0.0),
+                worst_ms=hub.get('Wrst', 0.0),
+                stddev_ms=hub.get('StDev', 0.0),  # This is our jitter metric
+            )
+            for hub in mtr_data['report']['hubs']
+        ]
+
+    def write_prometheus_metrics(self, hops: List[Hop], fp: BinaryIO):
+        """Write Prometheus format metrics to a binary file object"""
+        fp.writelines(self.iter_prometheus_chunks(hops))
 
-    def generate_prometheus_metrics(self, hops: List[Dict[str, Any]]) -> str:
-        """Generate Prometheus format metrics"""
-        metrics = []
+    def iter_prometheus_chunks(self, hops: List[Hop]) -> Iterator[bytes]:
+        """Yield the Prometheus exposition for the parsed hops as encoded chunks"""
+        target_labels = self._target_label
         
         # Add metadata
-        metrics.append(f"# HELP mtr_info MTR trace information")
-        metrics.append(f"# TYPE mtr_info gauge")
-        metrics.append(f'mtr_info{{target="{self.target}",port="{self.port}"}} 1')
-        metrics.append("")
+        yield self._info_block
         
-        # Packet loss percentage per hop
-        metrics.append("# HELP mtr_loss_percent Packet loss percentage per hop")
-        metrics.append("# TYPE mtr_loss_percent gauge")
+        # Per-hop metric families: one sweep over the hops fills a buffer per family,
+        # formatting each hop's labels once
+        buffers = [bytearray() for _ in _HOP_FAMILY_OUTPUT]
         for hop in hops:
-            labels = f'hop="{hop["hop"]}",host="{hop["host"]}",target="{self.target}"'
-            metrics.append(f'mtr_loss_percent{{{labels}}} {hop["loss_percent"]}')
-        metrics.append("")
+            labels = f'hop="{hop.hop}",host="{hop.host}",'.encode() + target_labels
+            for buf, (_, prefix, field, spec) in zip(buffers, _HOP_FAMILY_OUTPUT):
+                buf += prefix
+                buf += labels
+                buf += f'}} {hop[field]:{spec}}\n'.encode()
         
-        # Packets sent per hop
-        metrics.append("# HELP mtr_packets_sent Total packets sent per hop")
-        metrics.append("# TYPE mtr_packets_sent counter")
-        for hop in hops:
-            labels = f'hop="{hop["hop"]}",host="{hop["host"]}",target="{self.target}"'
-            metrics.append(f'mtr_packets_sent{{{labels}}} {hop["sent"]}')
-        metrics.append("")
-        
-        # Last round trip time
-        metrics.append("# HELP mtr_last_rtt_ms Last round trip time in milliseconds")
-        metrics.append("# TYPE mtr_last_rtt_ms gauge")
-        for hop in hops:
-            labels = f'hop="{hop["hop"]}",host="{hop["host"]}",target="{self.target}"'
-            metrics.append(f'mtr_last_rtt_ms{{{labels}}} {hop["last_ms"]}')
-        metrics.append("")
-        
-        # Average round trip time
-        metrics.append("# HELP mtr_avg_rtt_ms Average round trip time in milliseconds")
-        metrics.append("# TYPE mtr_avg_rtt_ms gauge")
-        for hop in hops:
-            labels = f'hop="{hop["hop"]}",host="{hop["host"]}",target="{self.target}"'
-            metrics.append(f'mtr_avg_rtt_ms{{{labels}}} {hop["avg_ms"]}')
-        metrics.append("")
-        
-        # Best round trip time
-        metrics.append("# HELP mtr_best_rtt_ms Best round trip time in milliseconds")
-        metrics.append("# TYPE mtr_best_rtt_ms gauge")
-        for hop in hops:
-            labels = f'hop="{hop["hop"]}",host="{hop["host"]}",target="{self.target}"'
-            metrics.append(f'mtr_best_rtt_ms{{{labels}}} {hop["best_ms"]}')
-        metrics.append("")
-        
-        # Worst round trip time
-        metrics.append("# HELP mtr_worst_rtt_ms Worst round trip time in milliseconds")
-        metrics.append("# TYPE mtr_worst_rtt_ms gauge")
-        for hop in hops:
-            labels = f'hop="{hop["hop"]}",host="{hop["host"]}",target="{self.target}"'
-            metrics.append(f'mtr_worst_rtt_ms{{{labels}}} {hop["worst_ms"]}')
-        metrics.append("")
-        
-        # Jitter (standard deviation)
-        metrics.append("# HELP mtr_jitter_ms Jitter (standard deviation) in milliseconds")
-        metrics.append("# TYPE mtr_jitter_ms gauge")
-        for hop in hops:
-            labels = f'hop="{hop["hop"]}",host="{hop["host"]}",target="{self.target}"'
-            metrics.append(f'mtr_jitter_ms{{{labels}}} {hop["stddev_ms"]}')
-        metrics.append("")
+        for (header, _, _, _), buf in zip(_HOP_FAMILY_OUTPUT, buffers):
+            yield header
+            yield buf
+            yield b"\n"
         
         # Total hop count
-        metrics.append("# HELP mtr_hop_count Total number of hops to target")
-        metrics.append("# TYPE mtr_hop_count gauge")
+        yield (b"# HELP mtr_hop_count Total number of hops to target\n"
+               b"# TYPE mtr_hop_count gauge\n")
         if hops:
-            metrics.append(f'mtr_hop_count{{target="{self.target}"}} {len(hops)}')
-        metrics.append("")
+            yield b'mtr_hop_count{' + target_labels + f'}} {len(hops)}\n'.encode()
+        yield b"\n"
         
         # End-to-end metrics (using last hop)
         if hops:
             last_hop = hops[-1]
-            metrics.append("# HELP mtr_end_to_end_loss_percent End-to-end packet loss percentage")
-            metrics.append("# TYPE mtr_end_to_end_loss_percent gauge")
-            metrics.append(f'mtr_end_to_end_loss_percent{{target="{self.target}"}} {last_hop["loss_percent"]}')
-            metrics.append("")
+            yield (b"# HELP mtr_end_to_end_loss_percent End-to-end packet loss percentage\n"
+                   b"# TYPE mtr_end_to_end_loss_percent gauge\n")
+            yield b'mtr_end_to_end_loss_percent{' + target_labels + f'}} {last_hop.loss_percent}\n\n'.encode()
             
-            metrics.append("# HELP mtr_end_to_end_avg_rtt_ms End-to-end average round trip time")
-            metrics.append("# TYPE mtr_end_to_end_avg_rtt_ms gauge")
-            metrics.append(f'mtr_end_to_end_avg_rtt_ms{{target="{self.target}"}} {last_hop["avg_ms"]}')
-            metrics.append("")
+            yield (b"# HELP mtr_end_to_end_avg_rtt_ms End-to-end average round trip time\n"
+                   b"# TYPE mtr_end_to_end_avg_rtt_ms gauge\n")
+            yield b'mtr_end_to_end_avg_rtt_ms{' + target_labels + f'}} {last_hop.avg_ms:{_RTT_FORMAT}}\n\n'.encode()
             
-            metrics.append("# HELP mtr_end_to_end_jitter_ms End-to-end jitter")
-            metrics.append("# TYPE mtr_end_to_end_jitter_ms gauge")
-            metrics.append(f'mtr_end_to_end_jitter_ms{{target="{self.target}"}} {last_hop["stddev_ms"]}')
-            metrics.append("")
+            yield (b"# HELP mtr_end_to_end_jitter_ms End-to-end jitter\n"
+                   b"# TYPE mtr_end_to_end_jitter_ms gauge\n")
+            yield b'mtr_end_to_end_jitter_ms{' + target_labels + f'}} {last_hop.stddev_ms:{_RTT_FORMAT}}\n\n'.encode()
         
         # Timestamp
-        metrics.append("# HELP mtr_last_run_timestamp_ms Timestamp of last MTR run")
-        metrics.append("# TYPE mtr_last_run_timestamp_ms gauge")
-        metrics.append(f'mtr_last_run_timestamp_ms{{target="{self.target}"}} {self.timestamp}')
-        
-        return "\n".join(metrics)
+        yield self._timestamp_block
 
     def export_to_file(self, output_file: str):
         """Run MTR and export metrics to file"""
-        print(f"Running MTR to {self.target}:{self.port}...")
+        log.debug("Running MTR to %s:%s", self.target, self.port)
         mtr_data = self.run_mtr()
         
-        print("Parsing MTR data...")
+        log.debug("Parsing MTR data")
         hops = self.parse_mtr_data(mtr_data)
         
         if not hops:
-            print("No hop data found")
+            log.error("No hop data found")
             sys.exit(1)
             
-        print(f"Found {len(hops)} hops")
-        
-        print("Generating Prometheus metrics...")
-        prometheus_metrics = self.generate_prometheus_metrics(hops)
+        log.debug("Found %d hops", len(hops))
+        self.write_metrics_file(hops, output_file)
+
+    async def export_to_file_async(self, output_file: str, semaphore: asyncio.Semaphore):
+        """Run MTR under the shared semaphore and export metrics to file"""
+        async with semaphore:
+            log.debug("Running MTR to %s:%s", self.target, self.port)
+            mtr_data = await self.run_mtr_async()
         
-        print(f"Writing metrics to {output_file}...")
-        with open(output_file, 'w') as f:
-            f.write(prometheus_metrics)
+        hops = self.parse_mtr_data(mtr_data)
+        if not hops:
+            raise RuntimeError("No hop data found")
+        self.write_metrics_file(hops, output_file)
+
+    def write_metrics_file(self, hops: List[Hop], output_file: str):
+        """Atomically write metrics for the parsed hops and print the per-hop summary"""
+        log.debug("Writing metrics to %s", output_file)
+        # Write to a temp file in the same directory and rename it into place, so the
+        # textfile collector never reads a partially written file
+        tmp = tempfile.NamedTemporaryFile(mode='wb', buffering=1 << 16,
+                                          dir=os.path.dirname(output_file) or '.',
+                                          prefix=os.path.basename(output_file) + '.', delete=False)
+        try:
+            self.write_prometheus_metrics(hops, tmp)
+            tmp.close()
+            os.chmod(tmp.name, 0o644)
+            os.replace(tmp.name, output_file)
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
             
-        print(f"Successfully exported metrics to {output_file}")
+        log.info("Exported %d hops to %s", len(hops), output_file)
         
         # Print summary
-        print("\nSummary:")
+        print(f"\nSummary for {self.target}:")
         for hop in hops:
-            print(f"  Hop {hop['hop']:2d}: {hop['host']:30s} "
-                  f"Loss: {hop['loss_percent']:5.1f}% "
-                  f"Avg: {hop['avg_ms']:7.2f}ms "
-                  f"Jitter: {hop['stddev_ms']:6.2f}ms")
+            print(f"  Hop {hop.hop:2d}: {hop.host:30s} "
+                  f"Loss: {hop.loss_percent:5.1f}% "
+                  f"Avg: {hop.avg_ms:7.2f}ms "
+                  f"Jitter: {hop.stddev_ms:6.2f}ms")
+
+def target_output_file(output: str, target: str) -> str:
+    """Per-target output path, e.g. mtr_metrics.prom -> mtr_metrics_www_google_com.prom"""
+    path = Path(output)
+    return str(path.with_name(f"{path.stem}_{target.replace('.', '_')}{path.suffix}"))
+
+async def run_all(jobs: List[Tuple[MTRPrometheusExporter, str]], concurrency: int = 8) -> int:
+    """Run (exporter, output file) jobs concurrently, at most `concurrency` at a time;
+    returns the failure count"""
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(
+        *(exporter.export_to_file_async(output_file, semaphore) for exporter, output_file in jobs),
+        return_exceptions=True
+    )
+    
+    failures = 0
+    for (exporter, _), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            log.error("%s: %s", exporter.target, result)
+            failures += 1
+    return failures
 
 def main():
     parser = argparse.ArgumentParser(description='Export MTR metrics to Prometheus format')
-    parser.add_argument('target', help='Target hostname or IP address')
+    parser.add_argument('targets', nargs='+', metavar='target',
+                        help='Target hostname or IP address; several targets are traced concurrently')
     parser.add_argument('-p', '--port', type=int, default=443, help='Target port (default: 443)')
     parser.add_argument('-c', '--count', type=int, default=10, help='Number of pings per hop (default: 10)')
     parser.add_argument('-i', '--interval', type=int, default=1, help='Interval between pings in seconds (default: 1)')
-    parser.add_argument('-o', '--output', default='mtr_metrics.prom', help='Output file (default: mtr_metrics.prom)')
+    parser.add_argument('-o', '--output', default='mtr_metrics.prom',
+                        help='Output file (default: mtr_metrics.prom); with several targets '
+                             'each writes <stem>_<target><suffix>')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Maximum concurrent mtr runs with several targets (default: 8)')
+    parser.add_argument('--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='Log level (default: INFO)')
     
     args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    
+    if len(args.targets) > 1:
+        jobs = [(MTRPrometheusExporter(target=t, port=args.port, count=args.count, interval=args.interval),
+                 target_output_file(args.output, t))
+                for t in args.targets]
+        sys.exit(1 if asyncio.run(run_all(jobs, args.concurrency)) else 0)
     
     exporter = MTRPrometheusExporter(
-        target=args.target,
+        target=args.targets[0],
         port=args.port,
         count=args.count,
         interval=args.interval
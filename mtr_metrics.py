@@ -7,7 +7,6 @@ TARGET="www.google.com"
 PORT=80
 OUTPUT_DIR="./output"
 OUTPUT_FILE="$OUTPUT_DIR/mtr_google.prom"
-TEMP_FILE="$OUTPUT_DIR/mtr_google.prom.tmp"
 LOG_FILE="./mtr_exporter.log"
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 PYTHON_SCRIPT="$SCRIPT_DIR/mtr_exporter.py"
@@ -39,15 +38,13 @@ fi
 
 log "Starting MTR export for $TARGET:$PORT"
 
-# Run the Python script and write to temporary file first
+# Run the Python script (it replaces the output file atomically)
 if python3 "$PYTHON_SCRIPT" "$TARGET" \
     --port "$PORT" \
-    --output "$TEMP_FILE" \
+    --output "$OUTPUT_FILE" \
     --custom-label "$CUSTOM_LABEL" \
     --log-level "$LOG_LEVEL" \
     --log-file "$LOG_FILE"; then
-    # Atomically move the temp file to final location
-    mv "$TEMP_FILE" "$OUTPUT_FILE"
     log "Successfully updated metrics file: $OUTPUT_FILE"
     
     # Set proper permissions if needed
@@ -62,8 +59,6 @@ if python3 "$PYTHON_SCRIPT" "$TARGET" \
     fi
 else
     log "ERROR: MTR export failed"
-    # Clean up temp file if it exists
-    [ -f "$TEMP_FILE" ] && rm -f "$TEMP_FILE"
     exit 1
 fi
 
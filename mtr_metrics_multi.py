@@ -183,19 +183,16 @@ else
     CUSTOM_LABEL="${CUSTOM_LABEL:-$DEFAULT_CUSTOM_LABEL}"
     
     OUTPUT_FILE="$OUTPUT_DIR/mtr_$(echo "$TARGET" | tr '.' '_').prom"
-    TEMP_FILE="$OUTPUT_FILE.tmp"
     
     log "Running in single probe mode for $TARGET:$PORT"
     
     if python3 "$PYTHON_SCRIPT" "$TARGET" \
         --port "$PORT" \
-        --output "$TEMP_FILE" \
+        --output "$OUTPUT_FILE" \
         --custom-label "$CUSTOM_LABEL" \
         --log-level "$LOG_LEVEL" \
         --log-file "$LOG_FILE"; then
         
-        # Atomically move the temp file to final location
-        mv "$TEMP_FILE" "$OUTPUT_FILE"
         log "Successfully updated metrics file: $OUTPUT_FILE"
         
         # Set proper permissions
@@ -210,8 +207,6 @@ else
         fi
     else
         log "ERROR: Single probe MTR export failed"
-        # Clean up temp file if it exists
-        [ -f "$TEMP_FILE" ] && rm -f "$TEMP_FILE"
         exit 1
     fi
 fi
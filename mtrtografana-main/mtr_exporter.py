@@ -6,15 +6,20 @@ Fixed version with proper Prometheus formatting and newline handling
 """
 
 import argparse
+import functools
 import sys
 import os
 import time
 import subprocess
 import json
+import logging
+import re
 import tempfile
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Any, NamedTuple, Optional, Tuple
 
 try:
     import yaml
@@ -23,11 +28,99 @@ except ImportError:
     print("Config mode will not work without PyYAML.")
     yaml = None
 
+# Parsed config files: path -> (st_mtime_ns, config); an unchanged file is not parsed again
+CONFIG_CACHE: Dict[str, Tuple[int, Any]] = {}
+
+# orjson parses mtr's JSON report faster when installed; the standard library is the fallback
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+log = logging.getLogger("mtr_exporter")
+LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+
+# Hop line of `mtr --report`, e.g.
+#   "  1.|-- _gateway     0.0%    10    1.6   1.6   1.6   1.8   0.1"
+# Fields: hop, host, loss%, sent, last, avg, best, worst and (optional) stddev
+HOP_LINE_RE = re.compile(
+    r'^[ \t]*(\d+)\.[ \t]*[|`]--[ \t]+(\S+)[ \t]+([\d.]+)%[ \t]+(\d+)'
+    r'[ \t]+([\d.]+)[ \t]+([\d.]+)[ \t]+([\d.]+)[ \t]+([\d.]+)(?:[ \t]+([\d.]+))?',
+    re.MULTILINE
+)
+
+# Characters kept in label values besides alphanumerics
+LABEL_SAFE_CHARS = '-_.:/'
+
+# str.translate table for ASCII label values: spaces become '_', unsafe characters are dropped
+_LABEL_SCRUB_TABLE = {i: None for i in range(128) if not (chr(i).isalnum() or chr(i) in LABEL_SAFE_CHARS)}
+_LABEL_SCRUB_TABLE[ord(' ')] = '_'
+
+
+def scrub_label_value(value: str) -> str:
+    """Remove spaces and problematic characters from a Prometheus label value"""
+    if value.isascii():
+        return value.translate(_LABEL_SCRUB_TABLE)
+    # Non-ASCII values keep any unicode alphanumerics, so check them per character
+    value = value.replace(' ', '_')
+    return ''.join(c for c in value if c.isalnum() or c in LABEL_SAFE_CHARS)
+
+
+class Hop(NamedTuple):
+    """One hop of a trace, as parsed from mtr's JSON or text report"""
+    hop: int
+    host: str
+    loss_percent: float
+    sent: int
+    last_ms: float
+    avg_ms: float
+    best_ms: float
+    worst_ms: float
+    stddev_ms: float  # This is our jitter metric
+
+
+# Value formatters: one decimal for percentages and scores, two for milliseconds
+fmt1 = '%.1f'.__mod__
+fmt2 = '%.2f'.__mod__
+
+# Per-hop metric families: (metric name, Hop field, value formatter)
+HOP_METRICS = [
+    ('mtr_loss_percent', 'loss_percent', fmt1),
+    ('mtr_packets_sent', 'sent', str),
+    ('mtr_last_rtt_ms', 'last_ms', fmt2),
+    ('mtr_avg_rtt_ms', 'avg_ms', fmt2),
+    ('mtr_best_rtt_ms', 'best_ms', fmt2),
+    ('mtr_worst_rtt_ms', 'worst_ms', fmt2),
+    ('mtr_jitter_ms', 'stddev_ms', fmt2),
+]
+
+# Labels added to every per-hop metric on top of the probe's base labels
+HOP_LABEL_NAMES = frozenset(('hop', 'host', 'responding'))
+
+# Data-only flush for the temp metrics file: timestamps need not be durable. macOS only has fsync.
+_fdatasync = getattr(os, 'fdatasync', os.fsync)
+
+# Recent mtr results shared by all exporters in this process:
+# (target, protocol, port, count, interval) -> (time of the run, parsed mtr data)
+MTR_CACHE: Dict[tuple, tuple] = {}
+MTR_CACHE_LOCKS: Dict[tuple, threading.Lock] = {}
+
+# Whether the installed mtr produces usable JSON: None until a run tells us. Once mtr -j has failed
+# or printed something other than JSON where the text report worked, later runs go straight to the report.
+@functools.lru_cache(maxsize=1)
+def mtr_supports_json() -> bool:
+    """Check once per process whether the installed mtr can print a JSON report"""
+    try:
+        result = subprocess.run(['mtr', '--help'], capture_output=True, timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return b'--json' in result.stdout + result.stderr
+
 
 class MTRPrometheusExporter:
     def __init__(self, target: str, port: int = 443, count: int = 10, interval: int = 1, 
                  probe_name: str = "default", custom_labels: Optional[Dict[str, str]] = None,
-                 protocol: str = "icmp"):
+                 protocol: str = "icmp", cache_ttl: float = 0):
         self.target = target
         self.port = port
         self.count = count
@@ -35,10 +128,32 @@ class MTRPrometheusExporter:
         self.probe_name = probe_name
         self.custom_labels = custom_labels or {}
         self.protocol = protocol.lower()
+        self.cache_ttl = cache_ttl  # seconds; 0 disables reuse of earlier results
         self.timestamp = int(time.time() * 1000)  # milliseconds
+        # Target, probe and custom labels are fixed for this exporter, so clean them once
+        self.base_labels = self.build_labels()
         
     def run_mtr(self) -> Dict[str, Any]:
-        """Run mtr command and return parsed output"""
+        """Run mtr command and return parsed output, reusing a result younger than cache_ttl;
+        raises RuntimeError if mtr cannot be run"""
+        cache_key = (self.target, self.protocol, self.port, self.count, self.interval)
+        if self.cache_ttl <= 0:
+            return self._run_mtr_uncached()
+        
+        # Concurrent probes of the same key wait for the first one instead of running mtr twice
+        with MTR_CACHE_LOCKS.setdefault(cache_key, threading.Lock()):
+            cached = MTR_CACHE.get(cache_key)
+            if cached and time.time() - cached[0] < self.cache_ttl:
+                log.info("Reusing MTR result for %s from %.0fs ago", self.target, time.time() - cached[0])
+                return cached[1]
+            
+            mtr_data = self._run_mtr_uncached()
+            MTR_CACHE[cache_key] = (time.time(), mtr_data)
+            return mtr_data
+
+    def _run_mtr_uncached(self) -> Dict[str, Any]:
+        """Run the mtr command, trying JSON output first and falling back to the text report;
+        raises RuntimeError if mtr cannot be run"""
         
         # Build base command
         base_cmd = [
@@ -59,7 +174,7 @@ class MTRPrometheusExporter:
             # Port is not used with ICMP
             pass
         else:
-            print(f"Warning: Unknown protocol '{self.protocol}', defaulting to ICMP")
+            log.warning("Unknown protocol '%s', defaulting to ICMP", self.protocol)
         
         base_cmd.append(self.target)
         
@@ -72,139 +187,80 @@ class MTRPrometheusExporter:
         cmd_text.insert(1, '--report')  # Insert report flag after 'mtr'
         
         try:
-            # Try JSON format first
-            print(f"Trying JSON format: {' '.join(cmd_json)}")
-            print(f"Protocol: {self.protocol.upper()}, Port: {self.port if self.protocol in ['tcp', 'udp'] else 'N/A (ICMP)'}")
+            # Try JSON format first when this mtr supports it
+            if mtr_supports_json():
+                log.debug("Trying JSON format: %s", ' '.join(cmd_json))
             
-            result = subprocess.run(cmd_json, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                                  universal_newlines=True, timeout=120)
+                # Raw bytes: both JSON parsers take them directly, so stdout is never decoded on this path
+                result = subprocess.run(cmd_json, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
+                                      bufsize=-1, timeout=120)
             
-            if result.returncode == 0:
-                print(f"MTR returned successfully. Output length: {len(result.stdout)} chars")
-                print(f"First 200 chars: {result.stdout[:200]}")
+                if result.returncode == 0:
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug("MTR returned %d bytes, starting: %s",
+                                  len(result.stdout), result.stdout[:200].decode('utf-8', 'replace'))
                 
-                try:
-                    json_data = json.loads(result.stdout)
-                    print("Successfully parsed JSON output")
-                    return json_data
-                except json.JSONDecodeError as e:
-                    print(f"JSON parsing failed: {e}")
-                    print("This might mean MTR was compiled without JSON support")
-            else:
-                print(f"JSON command failed with return code {result.returncode}")
-                if result.stderr:
-                    print(f"STDERR: {result.stderr}")
+                    # Cheap prefix check: an mtr without JSON support prints something that is not an object
+                    if result.stdout.lstrip()[:1] != b'{':
+                        log.warning("MTR output is not JSON (mtr may be built without JSON support)")
+                    else:
+                        try:
+                            json_data = json_loads(result.stdout)
+                            log.debug("Successfully parsed JSON output")
+                            return json_data
+                        except json.JSONDecodeError as e:  # orjson.JSONDecodeError is a subclass
+                            # Only this run's output is damaged; the next run tries JSON again
+                            log.warning("JSON parsing failed at byte %d of %d: %s",
+                                        e.pos, len(result.stdout), e.msg)
+                else:
+                    log.warning("JSON command failed with return code %d: %s",
+                                result.returncode, result.stderr.decode('utf-8', 'replace').strip())
             
             # Fall back to text format
-            print(f"Using text format: {' '.join(cmd_text)}")
+            log.debug("Using text format: %s", ' '.join(cmd_text))
             result = subprocess.run(cmd_text, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                                  universal_newlines=True, timeout=120)
+                                  bufsize=-1, timeout=120)
             
             if result.returncode != 0:
-                print(f"MTR command failed with return code {result.returncode}")
-                print(f"STDERR: {result.stderr}")
-                sys.exit(1)
-                
-            print("Successfully got text output, parsing...")
-            return self.parse_mtr_text_output(result.stdout)
+                raise RuntimeError(f"MTR command failed with return code {result.returncode}: "
+                                   f"{result.stderr.decode('utf-8', 'replace').strip()}")
+            
+            return self.parse_mtr_text_output(result.stdout.decode('utf-8', 'replace'))
             
         except subprocess.TimeoutExpired:
-            print("MTR command timed out")
-            sys.exit(1)
+            raise RuntimeError("MTR command timed out")
         except FileNotFoundError:
-            print("MTR command not found. Please install mtr package.")
-            sys.exit(1)
+            raise RuntimeError("MTR command not found. Please install mtr package.")
 
     def parse_mtr_text_output(self, text_output: str) -> Dict[str, Any]:
         """Parse traditional MTR text output"""
-        lines = text_output.strip().split('\n')
         hubs = []
         
-        print(f"Parsing {len(lines)} lines of MTR output...")
-        
-        # Find the data lines (skip header)
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Skip header lines
-            if line.startswith('Start:') or line.startswith('HOST:'):
-                continue
-                
-            # Parse hop lines like: "  1.|-- _gateway     0.0%    10    1.6   1.6   1.6   1.8   0.1"
-            if '|--' in line or ('|' in line and not line.startswith('|')):
-                # Split on whitespace but be more careful
-                parts = line.split()
-                print(f"Parsing line: {line}")
-                print(f"Split into {len(parts)} parts: {parts}")
-                
-                if len(parts) >= 7:
-                    try:
-                        # Extract hop number - it's before the first dot
-                        hop_str = parts[0].split('.')[0].strip()
-                        try:
-                            hop_num = int(hop_str)
-                        except ValueError:
-                            print(f"Warning: Could not parse hop number from: {hop_str}")
-                            continue
-                        
-                        # Host is the second part
-                        host = parts[1] if parts[1] != '???' else f"hop_{hop_num}"
-                        
-                        # Find the percentage - it should end with %
-                        loss_pct = 0.0
-                        loss_idx = -1
-                        for i, part in enumerate(parts):
-                            if part.endswith('%'):
-                                loss_pct = float(part.rstrip('%'))
-                                loss_idx = i
-                                break
-                        
-                        if loss_idx == -1:
-                            print(f"Warning: Could not find loss% in line: {line}")
-                            continue
-                            
-                        # The numeric values should be after the loss%
-                        numeric_parts = parts[loss_idx + 1:]
-                        if len(numeric_parts) >= 5:
-                            sent = int(numeric_parts[0])
-                            last = float(numeric_parts[1])
-                            avg = float(numeric_parts[2])
-                            best = float(numeric_parts[3])
-                            worst = float(numeric_parts[4])
-                            stddev = float(numeric_parts[5]) if len(numeric_parts) > 5 else 0.0
-                        else:
-                            print(f"Warning: Not enough numeric values in line: {line}")
-                            continue
-                        
-                        hub = {
-                            'count': hop_num,
-                            'host': host,
-                            'Loss%': loss_pct,
-                            'Snt': sent,
-                            'Last': last,
-                            'Avg': avg,
-                            'Best': best,
-                            'Wrst': worst,
-                            'StDev': stddev
-                        }
-                        hubs.append(hub)
-                        print(f"Successfully parsed hop {hop_num}: {host}")
-                        
-                    except (ValueError, IndexError) as e:
-                        print(f"Warning: Could not parse line: {line} - {e}")
-                        continue
-        
-        print(f"Successfully parsed {len(hubs)} hops")
+        for match in HOP_LINE_RE.finditer(text_output):
+            hop_num = int(match.group(1))
+            host = match.group(2)
+            stddev = match.group(9)
+            hubs.append({
+                'count': hop_num,
+                'host': host if host != '???' else f"hop_{hop_num}",
+                'Loss%': float(match.group(3)),
+                'Snt': int(match.group(4)),
+                'Last': float(match.group(5)),
+                'Avg': float(match.group(6)),
+                'Best': float(match.group(7)),
+                'Wrst': float(match.group(8)),
+                'StDev': float(stddev) if stddev else 0.0
+            })
+        
+        log.debug("Parsed %d hops from text output", len(hubs))
         return {'report': {'hubs': hubs}}
 
-    def parse_mtr_data(self, mtr_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def parse_mtr_data(self, mtr_data: Dict[str, Any]) -> List[Hop]:
         """Parse MTR JSON data and extract metrics"""
         hops = []
         
         if 'report' not in mtr_data or 'hubs' not in mtr_data['report']:
-            print("Invalid MTR data structure")
+            log.error("Invalid MTR data structure")
             return []
             
         for hub in mtr_data['report']['hubs']:
@@ -216,61 +272,71 @@ class MTRPrometheusExporter:
                 except ValueError:
                     hop_num = 0
             
-            hop_data = {
-                'hop': hop_num,
-                'host': hub.get('host', 'unknown'),
-                'loss_percent': float(hub.get('Loss%', 0.0)),
-                'sent': int(hub.get('Snt', 0)),
-                'last_ms': float(hub.get('Last', 0.0)),
-                'avg_ms': float(hub.get('Avg', 0.0)),
-                'best_ms': float(hub.get('Best', 0.0)),
-                'worst_ms': float(hub.get('Wrst', 0.0)),
-                'stddev_ms': float(hub.get('StDev', 0.0)),  # This is our jitter metric
-            }
-            hops.append(hop_data)
+            hops.append(Hop(
+                hop=hop_num,
+                host=hub.get('host', 'unknown'),
+                loss_percent=float(hub.get('Loss%', 0.0)),
+                sent=int(hub.get('Snt', 0)),
+                last_ms=float(hub.get('Last', 0.0)),
+                avg_ms=float(hub.get('Avg', 0.0)),
+                best_ms=float(hub.get('Best', 0.0)),
+                worst_ms=float(hub.get('Wrst', 0.0)),
+                stddev_ms=float(hub.get('StDev', 0.0)),  # This is our jitter metric
+            ))
             
         return hops
 
-    def calculate_path_health_summary(self, hops: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Calculate path health summary metrics"""
+    def calculate_path_health_summary(self, hops: List[Hop],
+                                      valid_hops: Optional[List[Hop]] = None) -> Dict[str, Any]:
+        """Calculate path health summary metrics; valid_hops may be passed in when already known"""
         if not hops:
             return {}
         
         # Filter out hops with 100% loss (like ??? hops that don't respond to ICMP)
-        valid_hops = [hop for hop in hops if hop['loss_percent'] < 100.0]
+        if valid_hops is None:
+            valid_hops = [hop for hop in hops if hop.loss_percent < 100.0]
         
         if not valid_hops:
             # If no hops respond, but we have hops, use the last hop for end-to-end metrics
             if hops:
-                print("Warning: No hops respond to ICMP, using last hop for end-to-end metrics")
-                end_to_end_loss = hops[-1]['loss_percent']
-                end_to_end_rtt = hops[-1]['avg_ms']
-                end_to_end_jitter = hops[-1]['stddev_ms']
+                log.warning("No hops respond to ICMP, using last hop for end-to-end metrics")
+                end_to_end_loss = hops[-1].loss_percent
+                end_to_end_rtt = hops[-1].avg_ms
+                end_to_end_jitter = hops[-1].stddev_ms
             else:
                 return {}
         else:
             # Use the last valid hop for end-to-end metrics
             last_valid_hop = valid_hops[-1]
-            end_to_end_loss = last_valid_hop['loss_percent']
-            end_to_end_rtt = last_valid_hop['avg_ms']
-            end_to_end_jitter = last_valid_hop['stddev_ms']
-        
-        # For path analysis, use the actual end-to-end loss (last hop)
-        # Many intermediate routers don't respond to ICMP but forward packets fine
-        total_loss = hops[-1]['loss_percent'] if hops else 0.0
+            end_to_end_loss = last_valid_hop.loss_percent
+            end_to_end_rtt = last_valid_hop.avg_ms
+            end_to_end_jitter = last_valid_hop.stddev_ms
         
-        # Average loss only for responding hops
-        avg_loss = sum(hop['loss_percent'] for hop in valid_hops) / len(valid_hops) if valid_hops else 0.0
-        
-        # Path stability (based on jitter across responding hops)
         if valid_hops:
-            avg_jitter = sum(hop['stddev_ms'] for hop in valid_hops) / len(valid_hops)
-            max_jitter = max(hop['stddev_ms'] for hop in valid_hops)
+            # One pass over the responding hops for loss, jitter and RTT spread
+            sum_loss = sum_jitter = 0.0
+            max_jitter = valid_hops[0].stddev_ms
+            min_rtt = max_rtt = valid_hops[0].avg_ms
+            for hop in valid_hops:
+                sum_loss += hop.loss_percent
+                jitter = hop.stddev_ms
+                sum_jitter += jitter
+                if jitter > max_jitter:
+                    max_jitter = jitter
+                rtt = hop.avg_ms
+                if rtt < min_rtt:
+                    min_rtt = rtt
+                elif rtt > max_rtt:
+                    max_rtt = rtt
             
+            # Average loss only for responding hops
+            avg_loss = sum_loss / len(valid_hops)
+            # Path stability (based on jitter across responding hops)
+            avg_jitter = sum_jitter / len(valid_hops)
             # Path consistency (RTT variance across responding hops)
-            rtts = [hop['avg_ms'] for hop in valid_hops]
-            rtt_variance = max(rtts) - min(rtts) if len(rtts) > 1 else 0.0
+            rtt_variance = max_rtt - min_rtt if len(valid_hops) > 1 else 0.0
         else:
+            avg_loss = 0.0
             avg_jitter = end_to_end_jitter
             max_jitter = end_to_end_jitter
             rtt_variance = 0.0
@@ -318,10 +384,7 @@ class MTRPrometheusExporter:
         clean_host = hostname.replace('???', f'hop_{hop_num}_silent')
         
         # Remove spaces and problematic characters
-        clean_host = clean_host.replace(' ', '_').replace('"', '').replace("'", '').replace('\n', '').replace('\t', '')
-        
-        # Keep only alphanumeric and safe characters
-        clean_host = ''.join(c for c in clean_host if c.isalnum() or c in '-_.:/')
+        clean_host = scrub_label_value(clean_host)
         
         # Fallback if cleaning resulted in empty string
         if not clean_host:
@@ -347,201 +410,131 @@ class MTRPrometheusExporter:
         # Clean all label values - remove spaces and problematic characters
         cleaned_labels = {}
         for key, value in labels.items():
-            # Convert to string and clean
-            clean_value = str(value).replace(' ', '_').replace('"', '').replace("'", '').replace('\n', '').replace('\t', '')
-            # Remove any other problematic characters
-            clean_value = ''.join(c for c in clean_value if c.isalnum() or c in '-_.:/')
-            cleaned_labels[key] = clean_value
+            cleaned_labels[key] = scrub_label_value(str(value))
         
         # Format as Prometheus labels
         label_parts = [f'{key}="{value}"' for key, value in cleaned_labels.items()]
         return ','.join(label_parts)
 
-    def format_float(self, value: float, precision: int = 2) -> str:
-        """Format float values with limited precision for Prometheus"""
-        # Always format with specified precision, even for integers
-        return f"{float(value):.{precision}f}"
+    def hop_labels(self, hop: Hop) -> str:
+        """Build label string for one hop's metrics: base labels plus hop, host and responding"""
+        host = self.clean_hostname(hop.host, hop.hop)
+        responding = 'true' if hop.loss_percent < 100.0 else 'false'
+        if HOP_LABEL_NAMES.isdisjoint(self.custom_labels):
+            # Hop number and host are already label-safe, so just extend the precomputed base labels
+            return f'{self.base_labels},hop="{hop.hop}",host="{host}",responding="{responding}"'
+        # A custom label shares a hop label's name; merge so the hop value replaces it in place
+        return self.build_labels({'hop': str(hop.hop), 'host': host, 'responding': responding})
 
-    def generate_prometheus_metrics(self, hops: List[Dict[str, Any]]) -> str:
-        """Generate Prometheus format metrics"""
-        metrics = []
-        
+    def generate_prometheus_metrics(self, hops: List[Hop]) -> Iterator[str]:
+        """Yield Prometheus format metric lines (no blank lines, no trailing newlines)"""
         # Base labels for metrics
-        base_labels = self.build_labels()
+        base_labels = self.base_labels
+        
+        # Separate responding and silent hops once; the summary and the per-hop metrics share it
+        responding_hops = [hop for hop in hops if hop.loss_percent < 100.0]
+        silent_count = len(hops) - len(responding_hops)
         
         # Calculate path health summary
-        summary = self.calculate_path_health_summary(hops)
+        summary = self.calculate_path_health_summary(hops, responding_hops)
         
         # Add metadata
         metadata_labels = f'{base_labels},port="{self.port}",protocol="{self.protocol}"'
-        metrics.append(f'mtr_info{{{metadata_labels}}} 1')
+        yield f'mtr_info{{{metadata_labels}}} 1'
         
         # Path Health Summary Metrics
         if summary:
-            metrics.append(f'mtr_path_health_score{{{base_labels}}} {self.format_float(summary["health_score"], 1)}')
-            metrics.append(f'mtr_path_rtt_variance_ms{{{base_labels}}} {self.format_float(summary["rtt_variance_ms"], 2)}')
-            metrics.append(f'mtr_path_avg_jitter_ms{{{base_labels}}} {self.format_float(summary["avg_jitter_ms"], 2)}')
-            metrics.append(f'mtr_path_max_jitter_ms{{{base_labels}}} {self.format_float(summary["max_jitter_ms"], 2)}')
+            yield f'mtr_path_health_score{{{base_labels}}} {fmt1(summary["health_score"])}'
+            yield f'mtr_path_rtt_variance_ms{{{base_labels}}} {fmt2(summary["rtt_variance_ms"])}'
+            yield f'mtr_path_avg_jitter_ms{{{base_labels}}} {fmt2(summary["avg_jitter_ms"])}'
+            yield f'mtr_path_max_jitter_ms{{{base_labels}}} {fmt2(summary["max_jitter_ms"])}'
             # FIXED: Use end_to_end_loss_percent instead of total_loss_percent to avoid confusion
-            metrics.append(f'mtr_path_end_to_end_loss_percent{{{base_labels}}} {self.format_float(summary["end_to_end_loss_percent"], 1)}')
-        
-        # Separate responding and silent hops
-        responding_hops = [hop for hop in hops if hop['loss_percent'] < 100.0]
-        silent_hops = [hop for hop in hops if hop['loss_percent'] >= 100.0]
-        
-        # Only generate per-hop metrics if we have responding hops
-        if responding_hops:
-            # Packet loss percentage per hop (only responding hops for main metrics)
-            for hop in responding_hops:
-                clean_host = self.clean_hostname(hop['host'], hop['hop'])
-                hop_labels = self.build_labels({
-                    'hop': str(hop['hop']), 
-                    'host': clean_host,
-                    'responding': 'true'
-                })
-                metrics.append(f'mtr_loss_percent{{{hop_labels}}} {self.format_float(hop["loss_percent"], 1)}')
-            
-            # Packets sent per hop (responding only)
-            for hop in responding_hops:
-                clean_host = self.clean_hostname(hop['host'], hop['hop'])
-                hop_labels = self.build_labels({
-                    'hop': str(hop['hop']), 
-                    'host': clean_host,
-                    'responding': 'true'
-                })
-                metrics.append(f'mtr_packets_sent{{{hop_labels}}} {hop["sent"]}')
-            
-            # RTT metrics (responding hops only)
-            for hop in responding_hops:
-                clean_host = self.clean_hostname(hop['host'], hop['hop'])
-                hop_labels = self.build_labels({
-                    'hop': str(hop['hop']), 
-                    'host': clean_host,
-                    'responding': 'true'
-                })
-                metrics.append(f'mtr_last_rtt_ms{{{hop_labels}}} {self.format_float(hop["last_ms"], 2)}')
-            
-            for hop in responding_hops:
-                clean_host = self.clean_hostname(hop['host'], hop['hop'])
-                hop_labels = self.build_labels({
-                    'hop': str(hop['hop']), 
-                    'host': clean_host,
-                    'responding': 'true'
-                })
-                metrics.append(f'mtr_avg_rtt_ms{{{hop_labels}}} {self.format_float(hop["avg_ms"], 2)}')
-            
-            for hop in responding_hops:
-                clean_host = self.clean_hostname(hop['host'], hop['hop'])
-                hop_labels = self.build_labels({
-                    'hop': str(hop['hop']), 
-                    'host': clean_host,
-                    'responding': 'true'
-                })
-                metrics.append(f'mtr_best_rtt_ms{{{hop_labels}}} {self.format_float(hop["best_ms"], 2)}')
-            
-            for hop in responding_hops:
-                clean_host = self.clean_hostname(hop['host'], hop['hop'])
-                hop_labels = self.build_labels({
-                    'hop': str(hop['hop']), 
-                    'host': clean_host,
-                    'responding': 'true'
-                })
-                metrics.append(f'mtr_worst_rtt_ms{{{hop_labels}}} {self.format_float(hop["worst_ms"], 2)}')
-            
-            # Jitter (responding hops only)
-            for hop in responding_hops:
-                clean_host = self.clean_hostname(hop['host'], hop['hop'])
-                hop_labels = self.build_labels({
-                    'hop': str(hop['hop']), 
-                    'host': clean_host,
-                    'responding': 'true'
-                })
-                metrics.append(f'mtr_jitter_ms{{{hop_labels}}} {self.format_float(hop["stddev_ms"], 2)}')
+            yield f'mtr_path_end_to_end_loss_percent{{{base_labels}}} {fmt1(summary["end_to_end_loss_percent"])}'
+        
+        # Build each hop's label string once; every metric family below reuses it
+        hop_labels = [self.hop_labels(hop) for hop in hops]
+        responding_labeled = [(hop, labels) for hop, labels in zip(hops, hop_labels) if hop.loss_percent < 100.0]
+        
+        # Per-hop metrics, responding hops only
+        for metric_name, field, fmt in HOP_METRICS:
+            index = Hop._fields.index(field)
+            for hop, labels in responding_labeled:
+                yield f'{metric_name}{{{labels}}} {fmt(hop[index])}'
         
         # Silent hops summary (single metric to track count)
-        metrics.append(f'mtr_silent_hops_count{{{base_labels}}} {len(silent_hops)}')
+        yield f'mtr_silent_hops_count{{{base_labels}}} {silent_count}'
         
         # Total hop count - always generate
-        metrics.append(f'mtr_hop_count{{{base_labels}}} {len(hops)}')
+        yield f'mtr_hop_count{{{base_labels}}} {len(hops)}'
         
         # Responding hop count - always generate
-        metrics.append(f'mtr_responding_hop_count{{{base_labels}}} {len(responding_hops)}')
+        yield f'mtr_responding_hop_count{{{base_labels}}} {len(responding_hops)}'
         
         # End-to-end metrics - always generate if we have any hops
         if hops:
-            end_to_end_loss = summary.get('end_to_end_loss_percent', hops[-1]['loss_percent']) if summary else hops[-1]['loss_percent']
-            end_to_end_rtt = summary.get('end_to_end_rtt_ms', hops[-1]['avg_ms']) if summary else hops[-1]['avg_ms']
-            end_to_end_jitter = summary.get('end_to_end_jitter_ms', hops[-1]['stddev_ms']) if summary else hops[-1]['stddev_ms']
+            end_to_end_loss = summary.get('end_to_end_loss_percent', hops[-1].loss_percent) if summary else hops[-1].loss_percent
+            end_to_end_rtt = summary.get('end_to_end_rtt_ms', hops[-1].avg_ms) if summary else hops[-1].avg_ms
+            end_to_end_jitter = summary.get('end_to_end_jitter_ms', hops[-1].stddev_ms) if summary else hops[-1].stddev_ms
             
-            metrics.append(f'mtr_end_to_end_loss_percent{{{base_labels}}} {self.format_float(end_to_end_loss, 1)}')
-            metrics.append(f'mtr_end_to_end_avg_rtt_ms{{{base_labels}}} {self.format_float(end_to_end_rtt, 2)}')
-            metrics.append(f'mtr_end_to_end_jitter_ms{{{base_labels}}} {self.format_float(end_to_end_jitter, 2)}')
+            yield f'mtr_end_to_end_loss_percent{{{base_labels}}} {fmt1(end_to_end_loss)}'
+            yield f'mtr_end_to_end_avg_rtt_ms{{{base_labels}}} {fmt2(end_to_end_rtt)}'
+            yield f'mtr_end_to_end_jitter_ms{{{base_labels}}} {fmt2(end_to_end_jitter)}'
         
-        # All hops summary table (for debugging/reference) - always generate this if we have hops
-        if hops:
-            for hop in hops:
-                clean_host = self.clean_hostname(hop['host'], hop['hop'])
-                responding = 'true' if hop['loss_percent'] < 100.0 else 'false'
-                hop_labels = self.build_labels({
-                    'hop': str(hop['hop']), 
-                    'host': clean_host,
-                    'responding': responding
-                })
-                metrics.append(f'mtr_hop_info{{{hop_labels}}} 1')
+        # All hops summary table (for debugging/reference)
+        for labels in hop_labels:
+            yield f'mtr_hop_info{{{labels}}} 1'
         
         # REMOVED: Timestamp metric - text file collector doesn't like this
-        
-        return "\n".join(metrics)
 
-    def validate_prometheus_metrics(self, metrics_content: str) -> bool:
-        """Validate Prometheus metrics format"""
-        lines = metrics_content.strip().split('\n')
-        for i, line in enumerate(lines, 1):
-            line = line.strip()
-            if not line:
-                print(f"Warning: Empty line found at line {i}")
-                return False
-            
-            # Check if line matches basic prometheus format: metric_name{labels} value
-            if ' ' not in line:
-                print(f"Warning: Invalid format at line {i}: {line}")
-                return False
-            
-            parts = line.rsplit(' ', 1)
-            if len(parts) != 2:
-                print(f"Warning: Invalid format at line {i}: {line}")
-                return False
-            
-            metric_part, value_part = parts
-            
-            # Validate value is a number
-            try:
-                float(value_part)
-            except ValueError:
-                print(f"Warning: Invalid numeric value at line {i}: {value_part}")
-                return False
+    @staticmethod
+    def validate_metric_line(line: str) -> Optional[str]:
+        """Check one line against the basic Prometheus format; returns the problem, or None if valid"""
+        line = line.strip()
+        if not line:
+            return "empty line"
+        
+        # Check if line matches basic prometheus format: metric_name{labels} value
+        if ' ' not in line:
+            return f"invalid format: {line}"
         
-        return True
+        value_part = line.rsplit(' ', 1)[1]
+        
+        # Validate value is a number
+        try:
+            float(value_part)
+        except ValueError:
+            return f"invalid numeric value: {value_part}"
+        
+        return None
 
-    def atomic_write_metrics(self, content: str, output_file: str):
-        """Atomically write metrics to file"""
+    @staticmethod
+    def atomic_write_metrics(lines: Iterable[str], output_file: str, validate: bool = True) -> int:
+        """Validate and atomically write metric lines to file in a single pass;
+        returns the number of lines written, raises ValueError on an invalid line.
+        Pass validate=False for lines the caller has already checked."""
         # Write to temp file first
         temp_fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(output_file))
         
         try:
+            count = 0
             with os.fdopen(temp_fd, 'w') as f:
-                f.write(content)
-                # CRITICAL: Ensure file ends with newline for Prometheus parsing
-                if not content.endswith('\n'):
+                for count, line in enumerate(lines, 1):
+                    if validate:
+                        problem = MTRPrometheusExporter.validate_metric_line(line)
+                        if problem:
+                            raise ValueError(f"line {count}: {problem}")
+                    f.write(line)
+                    # CRITICAL: Every line, including the last, ends with a newline for Prometheus parsing
                     f.write('\n')
                 f.flush()
-                os.fsync(f.fileno())  # Force write to disk
+                _fdatasync(f.fileno())  # Force write to disk
+                # Set proper permissions for text file collector before the file becomes visible
+                os.fchmod(f.fileno(), 0o644)
             
-            # Atomic move
-            os.rename(temp_path, output_file)
-            # Set proper permissions for text file collector
-            os.chmod(output_file, 0o644)
-            print(f"? Atomically wrote metrics to {output_file}")
+            # Atomic move, replacing any previous metrics file
+            os.replace(temp_path, output_file)
+            log.debug("Atomically wrote %d metrics to %s", count, output_file)
+            return count
             
         except Exception as e:
             # Clean up temp file on error
@@ -553,61 +546,33 @@ class MTRPrometheusExporter:
 
     def export_to_file(self, output_file: str):
         """Run MTR and export metrics to file"""
-        print(f"Running MTR to {self.target}:{self.port} (probe: {self.probe_name})...")
-        mtr_data = self.run_mtr()
+        log.debug("Running MTR to %s:%s (probe: %s)", self.target, self.port, self.probe_name)
+        try:
+            mtr_data = self.run_mtr()
+        except RuntimeError as e:
+            log.error("%s", e)
+            sys.exit(1)
         
-        print("Parsing MTR data...")
         hops = self.parse_mtr_data(mtr_data)
         
         if not hops:
-            print("No hop data found")
+            log.error("No hop data found")
             sys.exit(1)
-            
-        print(f"Found {len(hops)} hops")
         
-        print("Generating Prometheus metrics...")
+        # Lines are generated, validated and written in one pass
         prometheus_metrics = self.generate_prometheus_metrics(hops)
+        if log.isEnabledFor(logging.DEBUG):
+            sample_lines = list(islice(prometheus_metrics, 3))
+            log.debug("Sample metrics:\n  %s", '\n  '.join(sample_lines))
+            prometheus_metrics = chain(sample_lines, prometheus_metrics)
         
-        # Remove any blank lines before writing
-        clean_metrics = '\n'.join(line for line in prometheus_metrics.split('\n') if line.strip())
-        
-        # Validate metrics format
-        if not self.validate_prometheus_metrics(clean_metrics):
-            print("ERROR: Generated metrics failed validation!")
-            print("First 500 chars of metrics:")
-            print(clean_metrics[:500])
+        try:
+            count = self.atomic_write_metrics(prometheus_metrics, output_file)
+        except ValueError as e:
+            log.error("Generated metrics failed validation! %s", e)
             sys.exit(1)
         
-        print(f"? Generated {len(clean_metrics.split(chr(10)))} valid metrics")
-        print("Sample metrics (first 3 lines):")
-        sample_lines = clean_metrics.split('\n')[:3]
-        for line in sample_lines:
-            print(f"  {line}")
-        
-        print(f"Writing metrics to {output_file}...")
-        self.atomic_write_metrics(clean_metrics, output_file)
-        
-        print(f"Successfully exported metrics to {output_file}")
-        
-        # Verify file was written correctly
-        try:
-            with open(output_file, 'r') as f:
-                written_content = f.read()
-            if len(written_content.strip()) == 0:
-                print("WARNING: Written file is empty!")
-            else:
-                written_lines = written_content.strip().split('\n')
-                print(f"? Verified: File contains {len(written_lines)} lines")
-                # Check file size
-                file_size = len(written_content)
-                print(f"? File size: {file_size} bytes")
-                # Verify ending newline
-                if written_content.endswith('\n'):
-                    print("? File ends with proper newline")
-                else:
-                    print("WARNING: File missing final newline!")
-        except Exception as e:
-            print(f"WARNING: Could not verify written file: {e}")
+        log.info("Exported %d metrics for %d hops to %s", count, len(hops), output_file)
         
         # Print path health summary
         summary = self.calculate_path_health_summary(hops)
@@ -628,48 +593,94 @@ class MTRPrometheusExporter:
         # Print detailed per-hop summary
         print(f"\n=== DETAILED HOP ANALYSIS for {self.probe_name} ===")
         for hop in hops:
-            clean_host_display = self.clean_hostname(hop['host'], hop['hop'])
-            if hop['loss_percent'] == 100.0:
+            clean_host_display = self.clean_hostname(hop.host, hop.hop)
+            if hop.loss_percent == 100.0:
                 status = "[SILENT]"  # Silent hop (doesn't respond but forwards)
                 note = " (silent - forwards but doesn't respond)"
-            elif hop['loss_percent'] > 0:
+            elif hop.loss_percent > 0:
                 status = "[WARN] "
-                note = f" ({hop['loss_percent']:.1f}% loss)"
+                note = f" ({hop.loss_percent:.1f}% loss)"
             else:
                 status = "[OK]   "
                 note = ""
                 
-            print(f"  {status} Hop {hop['hop']:2d}: {clean_host_display:30s} "
-                  f"RTT: {hop['avg_ms']:7.2f}ms "
-                  f"Jitter: {hop['stddev_ms']:6.2f}ms{note}")
+            print(f"  {status} Hop {hop.hop:2d}: {clean_host_display:30s} "
+                  f"RTT: {hop.avg_ms:7.2f}ms "
+                  f"Jitter: {hop.stddev_ms:6.2f}ms{note}")
+
+
+def setup_logging(level: str = 'INFO'):
+    """Configure log output for the command line entry points"""
+    logging.basicConfig(level=getattr(logging, str(level).upper(), logging.INFO),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
 
 
 def load_config(config_file: str) -> Dict[str, Any]:
     """Load configuration from YAML file"""
     if yaml is None:
-        print("ERROR: PyYAML is required for config mode. Install with: pip3 install PyYAML")
+        log.error("PyYAML is required for config mode. Install with: pip3 install PyYAML")
         sys.exit(1)
         
     try:
+        mtime = os.stat(config_file).st_mtime_ns
+        cached = CONFIG_CACHE.get(config_file)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        
         with open(config_file, 'r') as f:
-            return yaml.safe_load(f)
+            # libyaml's C loader when PyYAML was built with it, else the pure Python one
+            config = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+        CONFIG_CACHE[config_file] = (mtime, config)
+        return config
     except FileNotFoundError:
-        print(f"Configuration file not found: {config_file}")
+        log.error("Configuration file not found: %s", config_file)
         sys.exit(1)
     except yaml.YAMLError as e:
-        print(f"Error parsing configuration file: {e}")
+        log.error("Error parsing configuration file: %s", e)
         sys.exit(1)
 
 
-def run_config_mode(config_file: str, output_dir: str = None):
+def run_probe(probe_config: Dict[str, Any], mtr_cycles: int,
+              cache_ttl: float = 0) -> Optional[Tuple[MTRPrometheusExporter, List[Hop]]]:
+    """Run one configured probe; returns its exporter and parsed hops, or None if skipped.
+    Raises RuntimeError if its mtr run fails."""
+    probe_name = probe_config.get('name', 'unknown')
+    target = probe_config.get('target')
+    port = probe_config.get('port', 443)
+    protocol = probe_config.get('protocol', 'icmp')  # Default to ICMP
+    labels = probe_config.get('labels', {})
+    
+    if not target:
+        log.warning("Skipping probe '%s': no target specified", probe_name)
+        return None
+    
+    log.info("Running probe %s: %s:%s (%s)", probe_name, target, port, protocol.upper())
+    
+    exporter = MTRPrometheusExporter(
+        target=target,
+        port=port,
+        count=mtr_cycles,
+        probe_name=probe_name,
+        custom_labels=labels,
+        protocol=protocol,
+        cache_ttl=cache_ttl
+    )
+    
+    mtr_data = exporter.run_mtr()
+    return exporter, exporter.parse_mtr_data(mtr_data)
+
+
+def run_config_mode(config_file: str, output_dir: str = None, log_level: str = None):
     """Run multiple probes based on configuration file"""
     config = load_config(config_file)
     
     # Get global settings
     global_config = config.get('global', {})
+    setup_logging(log_level or global_config.get('log_level', 'INFO'))
     if output_dir is None:
         output_dir = global_config.get('output_dir', './output')
     mtr_cycles = global_config.get('mtr_cycles', 10)
+    cache_ttl = global_config.get('cache_ttl', 0)
     
     # Create output directory
     Path(output_dir).mkdir(parents=True, exist_ok=True)
@@ -677,117 +688,103 @@ def run_config_mode(config_file: str, output_dir: str = None):
     # Get probes configuration
     probes = config.get('probes', [])
     if not probes:
-        print("No probes defined in configuration file")
+        log.error("No probes defined in configuration file")
         sys.exit(1)
     
+    # mtr spends nearly all of its time waiting on the network, so probes run in threads.
+    # Each mtr holds raw sockets; keep max_parallel below the host's socket/fd limits.
+    try:
+        max_parallel = int(global_config.get('max_parallel', min(32, len(probes))))
+    except (TypeError, ValueError):
+        log.error("Invalid max_parallel in configuration: %r (expected a positive integer)",
+                  global_config.get('max_parallel'))
+        sys.exit(1)
+    if max_parallel < 1:
+        log.warning("max_parallel is %d, running probes one at a time", max_parallel)
+        max_parallel = 1
+    mtr_supports_json()  # detect once, before the workers share the answer
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        futures = [executor.submit(run_probe, probe_config, mtr_cycles, cache_ttl) for probe_config in probes]
+    
+    # Metric lines of each probe that passed validation
     all_metrics = []
     
-    for probe_config in probes:
-        probe_name = probe_config.get('name', 'unknown')
-        target = probe_config.get('target')
-        port = probe_config.get('port', 443)
-        protocol = probe_config.get('protocol', 'icmp')  # Default to ICMP
-        labels = probe_config.get('labels', {})
-        
-        if not target:
-            print(f"Skipping probe '{probe_name}': no target specified")
+    for probe_config, future in zip(probes, futures):
+        try:
+            result = future.result()
+        except Exception:
+            # A failed probe loses only itself, not the others' finished traces
+            log.exception("Probe '%s' failed", probe_config.get('name', 'unknown'))
             continue
-        
-        print(f"\n=== Running probe: {probe_name} ===")
-        print(f"Target: {target}:{port} ({protocol.upper()})")
-        
-        exporter = MTRPrometheusExporter(
-            target=target,
-            port=port,
-            count=mtr_cycles,
-            probe_name=probe_name,
-            custom_labels=labels,
-            protocol=protocol
-        )
-        
-        # Generate metrics
-        mtr_data = exporter.run_mtr()
-        hops = exporter.parse_mtr_data(mtr_data)
+        if result is None:
+            continue
+        exporter, hops = result
+        probe_name = exporter.probe_name
         
         if hops:
-            metrics = exporter.generate_prometheus_metrics(hops)
-            all_metrics.append(metrics)
+            # Validate per probe, so one malformed probe is dropped instead of failing the whole file
+            metrics = list(exporter.generate_prometheus_metrics(hops))
+            problem = next(filter(None, map(exporter.validate_metric_line, metrics)), None)
+            if problem:
+                log.error("Metrics for probe '%s' failed validation, leaving them out: %s", probe_name, problem)
+            else:
+                all_metrics.append(metrics)
             
-            # Print path health summary
+            # Collect this probe's report and write it at once rather than with a print() per line
+            report = []
+            
+            # Path health summary
             summary = exporter.calculate_path_health_summary(hops)
             if summary:
-                print(f"\n=== PATH HEALTH SUMMARY for {probe_name} ===")
-                print(f"Status: {summary['health_status']} (Score: {summary['health_score']}/100)")
-                print(f"End-to-End Loss: {summary['end_to_end_loss_percent']:.1f}%")
-                print(f"End-to-End RTT: {summary['end_to_end_rtt_ms']:.2f}ms")
-                print(f"End-to-End Jitter: {summary['end_to_end_jitter_ms']:.2f}ms")
-                print(f"Total Hops: {summary['hop_count']} ({summary['valid_hops']} respond to ICMP)")
-                print(f"RTT Variance: {summary['rtt_variance_ms']:.2f}ms")
+                report.append(f"\n=== PATH HEALTH SUMMARY for {probe_name} ===")
+                report.append(f"Status: {summary['health_status']} (Score: {summary['health_score']}/100)")
+                report.append(f"End-to-End Loss: {summary['end_to_end_loss_percent']:.1f}%")
+                report.append(f"End-to-End RTT: {summary['end_to_end_rtt_ms']:.2f}ms")
+                report.append(f"End-to-End Jitter: {summary['end_to_end_jitter_ms']:.2f}ms")
+                report.append(f"Total Hops: {summary['hop_count']} ({summary['valid_hops']} respond to ICMP)")
+                report.append(f"RTT Variance: {summary['rtt_variance_ms']:.2f}ms")
                 
                 if summary['valid_hops'] < summary['hop_count']:
                     non_responding = summary['hop_count'] - summary['valid_hops']
-                    print(f"Note: {non_responding} intermediate hops don't respond to ICMP (normal)")
+                    report.append(f"Note: {non_responding} intermediate hops don't respond to ICMP (normal)")
             
-            # Print condensed per-hop summary
-            print(f"\nDetailed hops for {probe_name}:")
+            # Condensed per-hop summary
+            report.append(f"\nDetailed hops for {probe_name}:")
             for hop in hops:
-                clean_host_display = exporter.clean_hostname(hop['host'], hop['hop'])
-                if hop['loss_percent'] == 100.0:
+                clean_host_display = exporter.clean_hostname(hop.host, hop.hop)
+                if hop.loss_percent == 100.0:
                     status = "[SILENT]"  # Silent hop
                     note = " (silent)"
-                elif hop['loss_percent'] > 0:
+                elif hop.loss_percent > 0:
                     status = "[WARN] "
-                    note = f" ({hop['loss_percent']:.1f}% loss)"
+                    note = f" ({hop.loss_percent:.1f}% loss)"
                 else:
                     status = "[OK]   "
                     note = ""
                     
-                print(f"  {status} Hop {hop['hop']:2d}: {clean_host_display:30s} "
-                      f"RTT: {hop['avg_ms']:7.2f}ms "
-                      f"Jitter: {hop['stddev_ms']:6.2f}ms{note}")
+                report.append(f"  {status} Hop {hop.hop:2d}: {clean_host_display:30s} "
+                              f"RTT: {hop.avg_ms:7.2f}ms "
+                              f"Jitter: {hop.stddev_ms:6.2f}ms{note}")
+            
+            sys.stdout.write('\n'.join(report) + '\n')
         else:
-            print(f"[ERROR] No hop data found for probe '{probe_name}'")
+            log.error("No hop data found for probe '%s'", probe_name)
     
     if not all_metrics:
-        print("No successful probe results")
-        sys.exit(1)
-    
-    # FIXED: Join with single newlines and clean before writing
-    combined_metrics = '\n'.join(all_metrics)
-    clean_metrics = '\n'.join(line for line in combined_metrics.split('\n') if line.strip())
-    
-    # Validate combined metrics
-    temp_exporter = MTRPrometheusExporter("temp", 443, 10, "validation", protocol="icmp")
-    if not temp_exporter.validate_prometheus_metrics(clean_metrics):
-        print("ERROR: Combined metrics failed validation!")
-        print("First 500 chars of combined metrics:")
-        print(clean_metrics[:500])
+        log.error("No successful probe results")
         sys.exit(1)
     
     # Write combined metrics to file atomically
     output_file = os.path.join(output_dir, "mtr_all_probes.prom")
     
     try:
-        # Use the atomic write method
-        write_exporter = MTRPrometheusExporter("dummy", 443, 10, "temp", protocol="icmp")  # Temporary instance for writing
-        write_exporter.atomic_write_metrics(clean_metrics, output_file)
-        print(f"\n=== Successfully wrote combined metrics to {output_file} ===")
-        
-        # Final verification
-        try:
-            with open(output_file, 'r') as f:
-                final_content = f.read()
-            final_lines = final_content.strip().split('\n')
-            print(f"? Final verification: {len(final_lines)} lines written")
-            if final_content.endswith('\n'):
-                print("? File properly ends with newline")
-            else:
-                print("ERROR: File missing final newline!")
-        except Exception as e:
-            print(f"WARNING: Could not verify final file: {e}")
+        # Every probe's lines were validated above
+        count = MTRPrometheusExporter.atomic_write_metrics(chain.from_iterable(all_metrics), output_file,
+                                                           validate=False)
+        log.info("Wrote %d combined metrics to %s", count, output_file)
         
     except Exception as e:
-        print(f"Failed to write output file: {e}")
+        log.error("Failed to write output file: %s", e)
         sys.exit(1)
 
 
@@ -812,10 +809,12 @@ SINGLE PROBE MODE:
   --probe-name NAME        Probe name for metrics (default: default)
   --protocol PROTOCOL      Protocol: icmp, tcp, udp (default: icmp)
   --label KEY=VALUE        Add custom label (can be used multiple times)
+  --log-level LEVEL        DEBUG, INFO, WARNING or ERROR (default: INFO)
 
 CONFIG MODE:
   --config FILE            Configuration file path
   --output-dir DIR         Override output directory from config
+  --log-level LEVEL        Override log_level from config (default: INFO)
 
 EXAMPLES:
   # Single probe with ICMP (default)
@@ -835,6 +834,8 @@ SAMPLE CONFIG FILE (mtr_config.yaml):
   global:
     output_dir: /usr/share/node_exporter/textfile_collector
     mtr_cycles: 10
+    cache_ttl: 60          # Optional: reuse one trace per target/protocol/port for 60s
+    max_parallel: 8        # Optional: probes traced at once (default: all, up to 32)
     
   probes:
     - name: cloudflare_dns
@@ -879,15 +880,17 @@ def main():
     # Check if --config is in args, if so use config mode
     if '--config' in sys.argv:
         if yaml is None:
-            print("ERROR: Config mode requires PyYAML. Install with: pip3 install PyYAML")
+            log.error("Config mode requires PyYAML. Install with: pip3 install PyYAML")
             sys.exit(1)
             
         parser = argparse.ArgumentParser(description='MTR to Prometheus Exporter - Config Mode')
         parser.add_argument('--config', required=True, help='Configuration file path')
         parser.add_argument('--output-dir', help='Override output directory from config')
+        parser.add_argument('--log-level', choices=LOG_LEVELS, type=str.upper,
+                            help='Log level (default: log_level from config, else INFO)')
         args = parser.parse_args()
         
-        run_config_mode(args.config, args.output_dir)
+        run_config_mode(args.config, args.output_dir, args.log_level)
         return
     
     # Otherwise use single probe mode (backwards compatible)
@@ -900,8 +903,11 @@ def main():
     parser.add_argument('--probe-name', default='default', help='Probe name for metrics (default: default)')
     parser.add_argument('--protocol', choices=['icmp', 'tcp', 'udp'], default='icmp', help='Protocol to use (default: icmp)')
     parser.add_argument('--label', action='append', help='Add custom label in key=value format')
+    parser.add_argument('--log-level', choices=LOG_LEVELS, type=str.upper, default='INFO',
+                        help='Log level (default: INFO)')
     
     args = parser.parse_args()
+    setup_logging(args.log_level)
     
     # Parse custom labels
     custom_labels = {}
@@ -0,0 +1,33 @@
+"""parse_mtr_raw must rebuild the same hops that mtr's own JSON report shows"""
+
+import json
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mtr_exporter import parse_mtr_raw  # noqa: E402
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+
+
+class ParseMtrRawTest(unittest.TestCase):
+    def assert_matches_json(self, name):
+        report = json.loads((FIXTURES / f'{name}.json').read_text())['report']
+        raw = (FIXTURES / f'{name}.raw').read_bytes()
+
+        parsed = parse_mtr_raw(raw, report['mtr']['dst'], report['mtr']['tests'])
+
+        self.assertEqual(parsed['report']['hubs'], report['hubs'])
+
+    def test_reached_target(self):
+        self.assert_matches_json('reached')
+
+    def test_unreached_target_trims_trailing_silent_hops(self):
+        # Probes went out to TTL 8, but mtr's report stops one hop past the last reply
+        self.assert_matches_json('unreached')
+
+
+if __name__ == '__main__':
+    unittest.main()